@@ -4,8 +4,10 @@ from .standardize.standardize_npsc import standardize as standardize_npsc
 from .standardize.standardize_nst import standardize as standardize_nst
 from .standardize.standardize_rundkast import standardize as standardize_rundkast
 
-from .parsers.nbtale_trans_parser import parse_nbtale
-from .parsers.npsc_parser import parse_npsc
-from .parsers.nst_parser import parse_nst
-from .parsers.rundkast_parser import parse_rundkast
+from .parsers.dedup import split_deduplicator
+from .parsers.nbtale_trans_parser import parse_nbtale, iter_nbtale
+from .parsers.npsc_parser import parse_npsc, iter_npsc, load_npsc_speaker_index
+from .parsers.nst_parser import parse_nst, iter_nst
+from .parsers.rundkast_parser import parse_rundkast, iter_rundkast
+from .parsers.wav_utils import segment_reader, wav_duration_prober
 
@@ -0,0 +1,87 @@
+import logging
+import os
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def audio_path_key(utterance, audio_root=None):
+    """Normalised audio path of the utterance, relative to audio_root if given, so that
+    the same recording is matched however the corpus path was written"""
+    path = utterance.audio_file
+    if audio_root is not None:
+        path = os.path.relpath(path, audio_root)
+    return os.path.normcase(os.path.normpath(path))
+
+
+def speaker_text_key(utterance, audio_root=None):
+    """The speaker and the prompt text of the utterance, with the text casefolded and
+    the whitespace collapsed"""
+    return (
+        utterance.speaker_id,
+        " ".join(utterance.sentence_text_raw.split()).casefold(),
+    )
+
+
+dedup_keys = {"audio_path": audio_path_key, "speaker_text": speaker_text_key}
+
+
+class split_deduplicator:
+    """Removes the utterances of the other splits that duplicate an utterance of the
+    reference split (e.g. the NST test utterances that are also in the train set).
+    The utterances of the reference split are indexed in a set per key as they pass,
+    so they have to come before the utterances they should be matched against.
+    keys are names in dedup_keys: "audio_path" matches on the normalised audio path,
+    relative to audio_root if given, and "speaker_text" on the speaker and prompt text.
+    A duplicate is counted under the first key that matches it.
+
+        dedup = split_deduplicator("nst_train", keys=["audio_path", "speaker_text"])
+        utterances = list(dedup(utterances))
+        dedup.log_summary()
+    """
+
+    def __init__(self, reference_split, keys=("audio_path",), audio_root=None):
+        unknown = [key for key in keys if key not in dedup_keys]
+        if unknown:
+            raise ValueError(
+                "Unknown dedup keys {}, use {}".format(unknown, list(dedup_keys))
+            )
+        self.reference_split = reference_split
+        self.keys = list(keys)
+        self.audio_root = audio_root
+        self.seen = {key: set() for key in self.keys}
+        self.duplicates = Counter({key: 0 for key in self.keys})
+
+    def is_duplicate(self, utterance):
+        """Indexes the utterance if it is in the reference split, otherwise returns
+        whether it is a duplicate of a reference utterance"""
+        if utterance.original_data_split == self.reference_split:
+            for key in self.keys:
+                self.seen[key].add(dedup_keys[key](utterance, self.audio_root))
+            return False
+        for key in self.keys:
+            if dedup_keys[key](utterance, self.audio_root) in self.seen[key]:
+                self.duplicates[key] += 1
+                return True
+        return False
+
+    def __call__(self, utterances):
+        """Yields the utterances that are not duplicates"""
+        for utterance in utterances:
+            if not self.is_duplicate(utterance):
+                yield utterance
+
+    @property
+    def removed(self):
+        return sum(self.duplicates.values())
+
+    def log_summary(self):
+        logger.info(
+            "{} duplicates of {} removed ({})".format(
+                self.removed,
+                self.reference_split,
+                ", ".join(
+                    "{}: {}".format(key, count) for key, count in self.duplicates.items()
+                ),
+            )
+        )
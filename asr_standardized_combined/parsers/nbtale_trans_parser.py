@@ -4,269 +4,17 @@ from .shared_classes import (
     consolidated_utterance,
     consolidated_utterance_phon,
 )
+from .nynorsk import nbtale_nynorsk_words, nynorsk_detector
+from .parse_cache import parse_cache
 import os
 import re
 
-number_pattern = re.compile("\d+")
-
-words_nn = [
-    "ein",
-    "dei",
-    "ikkje",
-    "eg",
-    "eit",
-    "me",
-    "frå",
-    "då",
-    "noreg",
-    "kva",
-    "meir",
-    "vere",
-    "talar",
-    "fleire",
-    "gjer",
-    "noko",
-    "arbeidarpartiet",
-    "korleis",
-    "desse",
-    "ver",
-    "kor",
-    "nokon",
-    "gjere",
-    "høgre",
-    "vera",
-    "vidare",
-    "ligg",
-    "betre",
-    "ifrå",
-    "handlar",
-    "same",
-    "kommunane",
-    "utan",
-    "røysta",
-    "røystar",
-    "vegner",
-    "synest",
-    "fleirtal",
-    "kommunar",
-    "sidan",
-    "tidlegare",
-    "kvar",
-    "sit",
-    "tydeleg",
-    "éin",
-    "eitt",
-    "arbeidsplassar",
-    "gong",
-    "saman",
-    "gjera",
-    "treng",
-    "veg",
-    "millionar",
-    "einig",
-    "allereie",
-    "pengar",
-    "innanfor",
-    "vert",
-    "særleg",
-    "eigentleg",
-    "fekk",
-    "kunna",
-    "korfor",
-    "einige",
-    "krevjande",
-    "eigen",
-    "kvart",
-    "voterast",
-    "viktigaste",
-    "ressursane",
-    "alvorleg",
-    "vanskeleg",
-    "fleirtalet",
-    "utfordringar",
-    "ressursar",
-    "høgare",
-    "tilstrekkeleg",
-    "deira",
-    "forbod",
-    "sivilombodsmannen",
-    "eigne",
-    "reforma",
-    "dårleg",
-    "framstegspartiet",
-    "finst",
-    "eige",
-    "aukar",
-    "utanfor",
-    "knytt",
-    "nokre",
-    "verda",
-    "delar",
-    "politireforma",
-    "snakkar",
-    "gonger",
-    "takkar",
-    "innan",
-    "bruka",
-    "atomvåpen",
-    "difor",
-    "sjølvsagt",
-    "kvifor",
-    "kome",
-    "høyrer",
-    "kristeleg",
-    "eigarskap",
-    "seinare",
-    "håpar",
-    "verkeleg",
-    "saksordførar",
-    "bidreg",
-    "raudt",
-    "innbyggarane",
-    "antal",
-    "ynskjer",
-    "set",
-    "annan",
-    "vanlege",
-    "løysingar",
-    "milliardar",
-    "såg",
-    "dyrevelferda",
-    "forventar",
-    "verkemiddel",
-    "høyring",
-    "finn",
-    "skriv",
-    "føreslå",
-    "konsesjonslova",
-    "bygga",
-    "tenester",
-    "noregs",
-    "aktørar",
-    "jobbar",
-    "sterkare",
-    "kven",
-    "eine",
-    "trass",
-    "sikrar",
-    "gruppehald",
-    "berekraftig",
-    "vesentleg",
-    "betydeleg",
-    "legga",
-    "stortingsfleirtalet",
-    "fornøgd",
-    "usikkerheit",
-    "pasientar",
-    "nemleg",
-    "høyrt",
-    "val",
-    "vedteke",
-    "tener",
-    "oppgåver",
-    "hovudsak",
-    "vurderingar",
-    "offentleg",
-    "endringane",
-    "framleis",
-    "takka",
-    "endå",
-    "utsett",
-    "vegen",
-    "halde",
-    "utfordringane",
-    "samarbeidspartia",
-    "trengst",
-    "forhandlingane",
-    "kystsamfunna",
-    "følgt",
-    "verkar",
-    "skapa",
-    "verdiar",
-    "offentlege",
-    "investeringar",
-    "einaste",
-    "konsekvensane",
-    "skikkeleg",
-    "gjekk",
-    "omfattande",
-    "avgjerande",
-    "talarstolen",
-    "statlege",
-    "svara",
-    "tilbod",
-    "lesa",
-    "nord-noreg",
-    "soldatar",
-    "spørje",
-    "brukar",
-    "staden",
-    "pasientane",
-    "eigedomar",
-    "konsekvensar",
-    "faglege",
-    "finna",
-    "ytterlegare",
-    "mogleg",
-    "openbert",
-    "eiga",
-    "innbyggarar",
-    "manglar",
-    "innbyggjarane",
-    "pengane",
-    "såkalla",
-    "reglar",
-    "utanlandske",
-    "personar",
-    "sjølvstendig",
-    "folkevalde",
-    "seia",
-    "støttar",
-    "representantane",
-    "koma",
-    "vedtaka",
-    "vedteken",
-    "parkane",
-    "brukast",
-    "nemnde",
-    "enklare",
-    "krev",
-    "utvalet",
-    "tal",
-    "stortingsrepresentantane",
-    "naturleg",
-    "forsvarleg",
-    "fiskarar",
-    "eigedom",
-    "tilsvarande",
-    "setta",
-    "breitt",
-    "gjerast",
-    "låg",
-    "fortsetta",
-    "teke",
-    "tala",
-    "byane",
-    "samstundes",
-    "valt",
-    "dårlegare",
-    "næringar",
-    "refererast",
-    "regionalparkar",
-    "politikarar",
-    "aukande",
-    "viktigare",
-    "resultata",
-]
+# bump when the parsed utterances change, so that cached .trans files are parsed again
+nbtale_parser_version = 1
 
+number_pattern = re.compile("\d+")
 
-def pred_nynorsk(sent, wl):
-    lang = "nb-NO"
-    for word in sent.lower().split(" "):
-        if word in wl:
-            lang = "nn-NO"
-            break
-    return lang
+nbtale_nynorsk = nynorsk_detector(nbtale_nynorsk_words)
 
 
 def get_gender(speaker_id, genderdict):
@@ -278,12 +26,17 @@ def get_gender(speaker_id, genderdict):
         return "unknown"
 
 
-def process_trans_files_parts_1_2(trans_file):
+def iter_trans_lines(trans_file):
+    '''Yields the lines of a .trans file together with their tab-separated fields,
+    reading the file one line at a time and skipping the headers/other commented lines'''
     with open(trans_file, "r") as open_f:
-        data = open_f.read()
-    transcription_lines = data.split("\n")
-    # remove the headers/other commented lines
-    transcription_lines = [l for l in transcription_lines if len(l) > 0 and l[0] != "#"]
+        for line in open_f:
+            line = line.rstrip("\n")
+            if len(line) > 0 and line[0] != "#":
+                yield line, line.split("\t")
+
+
+def process_trans_files_parts_1_2(trans_file):
 
     # this will be a dict where keys are file names and values are file_transcript(s)
     transcription_by_file = {}
@@ -291,11 +44,11 @@ def process_trans_files_parts_1_2(trans_file):
     current_transcript = file_transcript()
     current_word = ""
 
-    for line in transcription_lines:
+    for line, fields in iter_trans_lines(trans_file):
         if line[:5] == '"part':
             current_file = line.strip('"')
-        elif len(line.split("\t")) == 4:
-            word_line = line.split("\t")
+        elif len(fields) == 4:
+            word_line = fields
             word = word_line[-1]
             if word == "<end>":
                 # wrap up the file transcript
@@ -321,9 +74,9 @@ def process_trans_files_parts_1_2(trans_file):
                 current_word = word_transcript(word, word_line[0], word_line[1])
                 # and add the first phoneme
                 current_word.add_phoneme(word_line[2], word_line[0], word_line[1])
-        elif len(line.split("\t")) == 3:
+        elif len(fields) == 3:
             # we only need to worry about updating the sound trancript
-            sound_line = line.split("\t")
+            sound_line = fields
             # first get the sound annotation addition out of the way
             current_word.add_phoneme(sound_line[2], sound_line[0], sound_line[1])
         else:
@@ -332,11 +85,6 @@ def process_trans_files_parts_1_2(trans_file):
 
 
 def process_trans_files_parts_3(trans_file):
-    with open(trans_file, "r") as open_f:
-        data = open_f.read()
-    transcription_lines = data.split("\n")
-    # remove the headers/other commented lines
-    transcription_lines = [l for l in transcription_lines if len(l) > 0 and l[0] != "#"]
 
     # this will be a dict where keys are file names and values are file_transcript(s)
     transcription_by_file = {}
@@ -345,7 +93,7 @@ def process_trans_files_parts_3(trans_file):
     current_word = ""
     speaker_utt_counter = 1
 
-    for line in transcription_lines:
+    for line, fields in iter_trans_lines(trans_file):
         if line[:5] == '"part':
             # first check that we have a speaker to wrap-up
             if current_file:
@@ -368,8 +116,8 @@ def process_trans_files_parts_3(trans_file):
             current_transcript = file_transcript()
             current_transcript.set_file_start(0)
 
-        elif len(line.split("\t")) > 2:
-            word_line = line.split("\t")
+        elif len(fields) > 2:
+            word_line = fields
             # we'll just treat all lines as start, end, word
             start = word_line[0]
             end = word_line[1]
@@ -438,11 +186,128 @@ def get_nbtale_dialect(group):
         return "east"
 
 
-def parse_nbtale(nbtale_dir, microphone="shure", phonetic=False):
-    '''By default, the file path to the Shure table microphone is given.
-    For the head microphone,  microphone="sennheiser"'''
-    
+def iter_nbtale_file(
+    annotation_path,
+    nbtale_dir,
+    all_informant_ids,
+    informant_genders,
+    microphone="shure",
+    phonetic=False,
+):
+    '''Yields the utterances of one NB Tale .trans file'''
     dataset_prefix = "nbtale_"
+    annotation_file = os.path.basename(annotation_path)
+    part = annotation_file.split(".")[0].split("_")[1]
+    if part != "3":
+        # let's parse it!
+        file_utterances = process_trans_files_parts_1_2(annotation_path)
+        languages = nbtale_nynorsk.predict_batch(
+            [utt.get_orthographic_readable() for utt in file_utterances.values()]
+        )
+        for file_utt_key, language in zip(file_utterances, languages):
+            spkr_id = file_utt_key.split("-")[0]
+            utt_id = file_utt_key.split("/")[-1]
+            spkr_id = get_speaker_id(spkr_id, all_informant_ids)
+            group = spkr_id.split("_")[1][1:]
+            file_utt = file_utterances[file_utt_key]
+            if not phonetic:
+                yield consolidated_utterance(
+                    dataset_prefix + spkr_id,
+                    get_gender(spkr_id, informant_genders),
+                    dataset_prefix + utt_id,
+                    language,
+                    file_utt.get_orthographic_readable(),
+                    os.path.join(
+                        nbtale_dir,
+                        f"{microphone}_{part}",
+                        file_utt_key + ".wav",
+                    ),
+                    f"nb_tale_part_{part}",
+                    get_nbtale_dialect(group),
+                    file_utt.get_file_duration() / 1000,  # convert to s
+                    0,
+                    file_utt.get_file_duration() / 1000,  # convert to s
+                    os.path.join(
+                        nbtale_dir,
+                        f"{microphone}_{part}",
+                        file_utt_key + ".wav",
+                    ),
+                )
+            else:
+                utt_words = [
+                    {
+                        "word": x.label,
+                        "start": float(x.start) / 1000,
+                        "end": float(x.end) / 1000,
+                    }
+                    for x in file_utt.get_words_transcripts()
+                ]
+                utt_phones = [
+                    {
+                        "phone": x.label,
+                        "start": float(x.start) / 1000,
+                        "end": float(x.end) / 1000,
+                    }
+                    for x in file_utt.get_all_phonemes()
+                ]
+                yield consolidated_utterance_phon(
+                    dataset_prefix + spkr_id,
+                    get_gender(spkr_id, informant_genders),
+                    dataset_prefix + utt_id,
+                    language,
+                    file_utt.get_orthographic_readable(),
+                    utt_words,
+                    utt_phones,
+                    os.path.join(
+                        nbtale_dir,
+                        f"{microphone}_{part}",
+                        file_utt_key + ".wav",
+                    ),
+                    f"nb_tale_part_{part}",
+                    get_nbtale_dialect(group),
+                    file_utt.get_file_duration() / 1000,  # convert to s
+                    0,
+                    file_utt.get_file_duration() / 1000,  # convert to s
+                )
+    else:
+        if phonetic:
+            pass
+        else:
+            file_utterances = process_trans_files_parts_3(annotation_path)
+            final_numbers = re.compile("_\d+($|.wav)")
+            for file_utt_key in file_utterances:
+                spkr_id = file_utt_key.split("-")[0]
+                utt_id = file_utt_key.split("/")[-1]
+                spkr_id = get_speaker_id(spkr_id, all_informant_ids)
+                group = spkr_id.split("_")[1][1:]
+                file_utt = file_utterances[file_utt_key]
+                file_utt_key_denumbered = final_numbers.sub("", file_utt_key)
+                yield consolidated_utterance(
+                    dataset_prefix + spkr_id,
+                    get_gender(spkr_id, informant_genders),
+                    dataset_prefix + utt_id,
+                    "nb-NO",
+                    file_utt.get_orthographic_readable(),
+                    os.path.join(
+                        nbtale_dir,
+                        f"{microphone}_{part}",
+                        file_utt_key_denumbered + ".wav",
+                    ),
+                    f"nb_tale_part_{part}",
+                    get_nbtale_dialect(group),
+                    file_utt.get_file_duration() / 1000,  # convert to s
+                    file_utt.get_file_start() / 1000,
+                    file_utt.get_file_end() / 1000,  # convert to s
+                )
+
+
+def iter_nbtale(nbtale_dir, microphone="shure", phonetic=False, cache_dir=None):
+    '''Generator version of parse_nbtale, yields the utterances one .trans file at a time.
+    By default, the file path to the Shure table microphone is given.
+    For the head microphone,  microphone="sennheiser".
+    With a cache_dir the parsed .trans files are stored there and only new or modified
+    ones are parsed again, see parse_cache'''
+    
     nbtale_dir = str(nbtale_dir)
     annotation_dir = os.path.join(nbtale_dir, "Annotation", "Annotation")
     informant_file = os.path.join(
@@ -453,125 +318,37 @@ def parse_nbtale(nbtale_dir, microphone="shure", phonetic=False):
     informant_metadata = get_informant_metadata(informant_file)
     all_informant_ids = [x[0] for x in informant_metadata]
     informant_genders = {x[0]: x[2] for x in informant_metadata}
-    all_utterances = []
+    cache = parse_cache(cache_dir, "nbtale", nbtale_parser_version)
     
     for annotation_file in os.listdir(annotation_dir):
         if ".trans" in annotation_file:
-            part = annotation_file.split(".")[0].split("_")[1]
-            if part != "3":
-                # let's parse it!
-                file_utterances = process_trans_files_parts_1_2(
-                    os.path.join(annotation_dir, annotation_file)
-                )
-                for file_utt_key in file_utterances:
-                    spkr_id = file_utt_key.split("-")[0]
-                    utt_id = file_utt_key.split("/")[-1]
-                    spkr_id = get_speaker_id(spkr_id, all_informant_ids)
-                    group = spkr_id.split("_")[1][1:]
-                    file_utt = file_utterances[file_utt_key]
-                    if not phonetic:
-                        all_utterances.append(
-                            consolidated_utterance(
-                                dataset_prefix + spkr_id,
-                                get_gender(spkr_id, informant_genders),
-                                dataset_prefix + utt_id,
-                                pred_nynorsk(
-                                    file_utt.get_orthographic_readable(), words_nn
-                                ),
-                                file_utt.get_orthographic_readable(),
-                                os.path.join(
-                                    nbtale_dir,
-                                    f"{microphone}_{part}",
-                                    file_utt_key + ".wav",
-                                ),
-                                f"nb_tale_part_{part}",
-                                get_nbtale_dialect(group),
-                                file_utt.get_file_duration() / 1000,  # convert to s
-                                0,
-                                file_utt.get_file_duration() / 1000,  # convert to s
-                                os.path.join(
-                                    nbtale_dir,
-                                    f"{microphone}_{part}",
-                                    file_utt_key + ".wav",
-                                ),
-                            )
-                        )
-                    else:
-                        utt_words = [
-                            {
-                                "word": x.label,
-                                "start": float(x.start) / 1000,
-                                "end": float(x.end) / 1000,
-                            }
-                            for x in file_utt.get_words_transcripts()
-                        ]
-                        utt_phones = [
-                            {
-                                "phone": x.label,
-                                "start": float(x.start) / 1000,
-                                "end": float(x.end) / 1000,
-                            }
-                            for x in file_utt.get_all_phonemes()
-                        ]
-                        all_utterances.append(
-                            consolidated_utterance_phon(
-                                dataset_prefix + spkr_id,
-                                get_gender(spkr_id, informant_genders),
-                                dataset_prefix + utt_id,
-                                pred_nynorsk(
-                                    file_utt.get_orthographic_readable(), words_nn
-                                ),
-                                file_utt.get_orthographic_readable(),
-                                utt_words,
-                                utt_phones,
-                                os.path.join(
-                                    nbtale_dir,
-                                    f"{microphone}_{part}",
-                                    file_utt_key + ".wav",
-                                ),
-                                f"nb_tale_part_{part}",
-                                get_nbtale_dialect(group),
-                                file_utt.get_file_duration() / 1000,  # convert to s
-                                0,
-                                file_utt.get_file_duration() / 1000,  # convert to s
-                            )
-                        )
-            else:
-                if phonetic:
-                    pass
-                else:
-                    file_utterances = process_trans_files_parts_3(
-                        os.path.join(annotation_dir, annotation_file)
-                    )
-                    final_numbers = re.compile("_\d+($|.wav)")
-                    for file_utt_key in file_utterances:
-                        spkr_id = file_utt_key.split("-")[0]
-                        utt_id = file_utt_key.split("/")[-1]
-                        spkr_id = get_speaker_id(spkr_id, all_informant_ids)
-                        group = spkr_id.split("_")[1][1:]
-                        file_utt = file_utterances[file_utt_key]
-                        file_utt_key_denumbered = final_numbers.sub("", file_utt_key)
-                        all_utterances.append(
-                            consolidated_utterance(
-                                dataset_prefix + spkr_id,
-                                get_gender(spkr_id, informant_genders),
-                                dataset_prefix + utt_id,
-                                "nb-NO",
-                                file_utt.get_orthographic_readable(),
-                                os.path.join(
-                                    nbtale_dir,
-                                    f"{microphone}_{part}",
-                                    file_utt_key_denumbered + ".wav",
-                                ),
-                                f"nb_tale_part_{part}",
-                                get_nbtale_dialect(group),
-                                file_utt.get_file_duration() / 1000,  # convert to s
-                                file_utt.get_file_start() / 1000,
-                                file_utt.get_file_end() / 1000,  # convert to s
-                            )
-                        )
+            annotation_path = os.path.join(annotation_dir, annotation_file)
+            # list() only runs when the file isn't in the cache
+            yield from cache.get(
+                [annotation_path, informant_file],
+                list,
+                iter_nbtale_file(
+                    annotation_path,
+                    nbtale_dir,
+                    all_informant_ids,
+                    informant_genders,
+                    microphone=microphone,
+                    phonetic=phonetic,
+                ),
+                params=(nbtale_dir, microphone, phonetic),
+            )
+    cache.log_summary()
 
-    return all_utterances
+
+def parse_nbtale(nbtale_dir, microphone="shure", phonetic=False, cache_dir=None):
+    '''By default, the file path to the Shure table microphone is given.
+    For the head microphone,  microphone="sennheiser".
+    With a cache_dir only new or modified .trans files are parsed, see iter_nbtale'''
+    return list(
+        iter_nbtale(
+            nbtale_dir, microphone=microphone, phonetic=phonetic, cache_dir=cache_dir
+        )
+    )
 
 
 if __name__ == "__main__":
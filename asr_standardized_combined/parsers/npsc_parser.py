@@ -1,6 +1,12 @@
 import json
 import os
-from .shared_classes import consolidated_utterance
+from functools import partial
+from multiprocessing import Pool
+from .parse_cache import parse_cache
+from .shared_classes import consolidated_utterance, npsc_utterance
+
+# bump when the parsed utterances change, so that cached sessions are parsed again
+npsc_parser_version = 1
 
 
 def create_sentence(tokens):
@@ -17,92 +23,204 @@ def create_sentence(tokens):
     return " ".join(sentence_words)
 
 
-def get_npsc_dialect(speaker_id, speaker_list):
-    speaker_data = {}
-    for d in speaker_list:
-        if d["speaker_id"] == speaker_id:
-            speaker_data = d
-            break
-    dialect = speaker_data["dialect"]
-    if dialect == "Northern Norway":
-        return "north"
-    elif dialect == "Southern Norway":
-        return "south"
-    elif dialect == "Western Norway":
-        return "west"
-    elif dialect == "Trøndelag":
-        return "mid"
-    elif dialect == "Eastern Norway":
-        return "east"
-    else:
-        return "unknown"
-
-
-def get_npsc_gender(speaker_id, speaker_list):
-    speaker_data = {}
+npsc_dialects = {
+    "Northern Norway": "north",
+    "Southern Norway": "south",
+    "Western Norway": "west",
+    "Trøndelag": "mid",
+    "Eastern Norway": "east",
+}
+
+
+def build_npsc_speaker_index(speaker_list):
+    """Index the speakers of NPSC_speaker_data.json by speaker_id, with the gender
+    and dialect already mapped to the codes of the consolidated_utterance, e.g.
+    {speaker_id: {"gender": "female", "dialect": "west", **other speaker data}}.
+    When a speaker_id appears several times, the first entry is used. Entries
+    without a dialect don't get the dialect key."""
+    speaker_index = {}
     for d in speaker_list:
-        if d["speaker_id"] == speaker_id:
-            speaker_data = d
-            break
-    gender = speaker_data.get("gender", "unknown")
-    if gender in ["male", "female", "unknown"]:
-        return gender
-    else:
-        return "unknown"
-
-
-def parse_npsc(npsc_dir):
-    all_nspc_consolidated_utterance = []
-    dataset_prefix = "npsc_"
-    with open(
-        os.path.join(npsc_dir, "project_files", "NPSC_speaker_data.json"), "r"
-    ) as sf:
-        speakers = json.load(sf)
-    for session_name in os.listdir(npsc_dir):
-        session_dir = os.path.join(npsc_dir, session_name)
-        if session_name[:2] == "20" and os.path.isdir(session_dir):
-            with open(
-                os.path.join(session_dir, "{}_token_data.json".format(session_name)),
-                "r",
-            ) as open_f:
-                data = json.load(open_f)
-            # load the sentence data so we can get sentence starts and ends
-            with open(
-                os.path.join(session_dir, "{}_sentence_data.json".format(session_name)),
-                "r",
-            ) as open_f:
-                sentence_data = json.load(open_f)
-            sentence_data_by_id = {
-                sd["sentence_id"]: {
-                    "start_time": sd["start_time"],
-                    "end_time": sd["end_time"],
-                }
-                for sd in sentence_data["sentences"]
-            }
-            audiofile = data["full_audio_file"]
-            split = data["data_split"]
-            for sentence in data["sentences"]:
-                sent_start = sentence_data_by_id[sentence["sentence_id"]]["start_time"]
-                sent_end = sentence_data_by_id[sentence["sentence_id"]]["end_time"]
-                all_nspc_consolidated_utterance.append(
-                    consolidated_utterance(
-                        dataset_prefix + str(sentence["speaker_id"]),
-                        get_npsc_gender(sentence["speaker_id"], speakers),
-                        dataset_prefix + str(sentence["sentence_id"]),
-                        sentence["sentence_language_code"]
-                        if "sentence_language_code" in sentence
-                        else sentence["tokens"][0]["language_code"],
-                        create_sentence(sentence["tokens"]),
-                        os.path.join(session_dir, audiofile),  # sentence["audio_file"],
-                        dataset_prefix + split,
-                        get_npsc_dialect(sentence["speaker_id"], speakers),
-                        (sent_end - sent_start) / 1000,
-                        sent_start / 1000,
-                        sent_end / 1000,
-                        os.path.join(session_dir, "audio", sentence["audio_file"]),
-                    )
-                )
-    return all_nspc_consolidated_utterance
+        if d["speaker_id"] in speaker_index:
+            continue
+        speaker_data = dict(d)
+        gender = d.get("gender", "unknown")
+        speaker_data["gender"] = (
+            gender if gender in ["male", "female", "unknown"] else "unknown"
+        )
+        if "dialect" in d:
+            speaker_data["dialect"] = npsc_dialects.get(d["dialect"], "unknown")
+        speaker_index[d["speaker_id"]] = speaker_data
+    return speaker_index
+
+
+def load_npsc_speaker_index(npsc_dir):
+    """Read project_files/NPSC_speaker_data.json in npsc_dir and return its speaker index,
+    see build_npsc_speaker_index. Useful to join speaker attributes to parsed utterances"""
+    with open(npsc_speaker_file(npsc_dir), "r") as sf:
+        return build_npsc_speaker_index(json.load(sf))
+
+
+def create_tokens(tokens):
+    """Compact version of the tokens of a sentence, a tuple of (token_text, standardized_form,
+    phon_ort_discrepancy) tuples, with standardized_form "" if there is none. create_sentence
+    encodes the same information as token_text|standardized_form and token_text|1 strings"""
+    return tuple(
+        (
+            token["token_text"],
+            token["standardized_form"] or "",
+            token.get("phon_ort_discrepancy") == 1,
+        )
+        for token in tokens
+    )
+
+
+def get_npsc_dialect(speaker_id, speaker_index):
+    # speaker_index is the output of build_npsc_speaker_index, a list of speaker data is indexed first
+    if not isinstance(speaker_index, dict):
+        speaker_index = build_npsc_speaker_index(speaker_index)
+    return speaker_index.get(speaker_id, {})["dialect"]
+
+
+def get_npsc_gender(speaker_id, speaker_index):
+    # speaker_index is the output of build_npsc_speaker_index, a list of speaker data is indexed first
+    if not isinstance(speaker_index, dict):
+        speaker_index = build_npsc_speaker_index(speaker_index)
+    return speaker_index.get(speaker_id, {}).get("gender", "unknown")
+
+
+def npsc_speaker_file(npsc_dir):
+    return os.path.join(npsc_dir, "project_files", "NPSC_speaker_data.json")
+
+
+def npsc_session_files(session_dir):
+    """The token data and sentence data json files of an NPSC session directory"""
+    session_name = os.path.basename(os.path.normpath(session_dir))
+    return (
+        os.path.join(session_dir, "{}_token_data.json".format(session_name)),
+        os.path.join(session_dir, "{}_sentence_data.json".format(session_name)),
+    )
+
+
+def parse_npsc_session(
+    session_dir, speakers, dataset_prefix="npsc_", structured_tokens=False
+):
+    """Parse the utterances of one NPSC session directory, speakers is the output of
+    build_npsc_speaker_index. With structured_tokens the utterances are npsc_utterance
+    objects that also keep the tokens of the sentence, see create_tokens"""
+    session_utterances = []
+    token_file, sentence_file = npsc_session_files(session_dir)
+    with open(token_file, "r") as open_f:
+        data = json.load(open_f)
+    # load the sentence data so we can get sentence starts and ends
+    with open(sentence_file, "r") as open_f:
+        sentence_data = json.load(open_f)
+    sentence_data_by_id = {
+        sd["sentence_id"]: {
+            "start_time": sd["start_time"],
+            "end_time": sd["end_time"],
+        }
+        for sd in sentence_data["sentences"]
+    }
+    audiofile = data["full_audio_file"]
+    split = data["data_split"]
+    for sentence in data["sentences"]:
+        sent_start = sentence_data_by_id[sentence["sentence_id"]]["start_time"]
+        sent_end = sentence_data_by_id[sentence["sentence_id"]]["end_time"]
+        utterance = consolidated_utterance
+        if structured_tokens:
+            utterance = partial(
+                npsc_utterance, tokens=create_tokens(sentence["tokens"])
+            )
+        session_utterances.append(
+            utterance(
+                dataset_prefix + str(sentence["speaker_id"]),
+                get_npsc_gender(sentence["speaker_id"], speakers),
+                dataset_prefix + str(sentence["sentence_id"]),
+                sentence["sentence_language_code"]
+                if "sentence_language_code" in sentence
+                else sentence["tokens"][0]["language_code"],
+                create_sentence(sentence["tokens"]),
+                os.path.join(session_dir, audiofile),  # sentence["audio_file"],
+                dataset_prefix + split,
+                get_npsc_dialect(sentence["speaker_id"], speakers),
+                (sent_end - sent_start) / 1000,
+                sent_start / 1000,
+                sent_end / 1000,
+                os.path.join(session_dir, "audio", sentence["audio_file"]),
+            )
+        )
+    return session_utterances
+
+
+def _parse_npsc_session_cached(
+    session_dir, speakers, cache, speaker_file, structured_tokens=False
+):
+    # returns the utterances and the cache hits and misses of this session
+    hits, misses = cache.hits, cache.misses
+    session_utterances = cache.get(
+        list(npsc_session_files(session_dir)) + [speaker_file],
+        parse_npsc_session,
+        session_dir,
+        speakers,
+        structured_tokens=structured_tokens,
+        params=(structured_tokens,),
+    )
+    return session_utterances, cache.hits - hits, cache.misses - misses
+
+
+def iter_npsc(npsc_dir, workers=1, cache_dir=None, structured_tokens=False):
+    """Generator version of parse_npsc, yields the utterances one session at a time,
+    in sorted session order. With workers > 1 (None for one per CPU) the sessions are
+    parsed in a pool of processes. With a cache_dir the parsed sessions are stored
+    there and only new or modified sessions are parsed again, see parse_cache.
+    With structured_tokens the utterances are npsc_utterance objects that also keep
+    the tokens of the sentence, see create_tokens."""
+    speakers = load_npsc_speaker_index(npsc_dir)
+    cache = parse_cache(cache_dir, "npsc", npsc_parser_version)
+    parse_session = partial(
+        _parse_npsc_session_cached,
+        speakers=speakers,
+        cache=cache,
+        speaker_file=npsc_speaker_file(npsc_dir),
+        structured_tokens=structured_tokens,
+    )
+    session_dirs = [
+        os.path.join(npsc_dir, session_name)
+        for session_name in sorted(os.listdir(npsc_dir))
+        if session_name[:2] == "20"
+        and os.path.isdir(os.path.join(npsc_dir, session_name))
+    ]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(session_dirs) < 2:
+        for session_dir in session_dirs:
+            session_utterances, _, _ = parse_session(session_dir)
+            yield from session_utterances
+        cache.log_summary()
+        return
+    with Pool(processes=min(workers, len(session_dirs))) as pool:
+        # imap keeps the order of the sessions
+        for session_utterances, hits, misses in pool.imap(parse_session, session_dirs):
+            cache.hits += hits
+            cache.misses += misses
+            yield from session_utterances
+    cache.log_summary()
+
+
+def parse_npsc(npsc_dir, workers=1, cache_dir=None, structured_tokens=False):
+    """Parse all the session directories (named 20*) of NPSC, in sorted order.
+    With workers > 1 (None for one per CPU) the sessions are parsed in a pool of
+    processes, the utterances are still returned in sorted session order.
+    With a cache_dir only new or modified sessions are parsed, see parse_cache.
+    With structured_tokens the utterances also keep their tokens, see iter_npsc."""
+    return list(
+        iter_npsc(
+            npsc_dir,
+            workers=workers,
+            cache_dir=cache_dir,
+            structured_tokens=structured_tokens,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -3,263 +3,25 @@ import re
 import sys
 import json
 from dataclasses import dataclass
-import wave
-import pandas as pd
+from .dedup import split_deduplicator
+from .nynorsk import nynorsk_detector, nynorsk_words
+from .parse_cache import parse_cache
 from .shared_classes import consolidated_utterance
+from .wav_utils import get_wav_duration, wav_duration_prober
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-words_nn = [
-    "ein",
-    "dei",
-    "ikkje",
-    "eg",
-    "eit",
-    "me",
-    "frå",
-    "då",
-    "noreg",
-    "kva",
-    "meir",
-    "vere",
-    "talar",
-    "fleire",
-    "gjer",
-    "noko",
-    "arbeidarpartiet",
-    "korleis",
-    "desse",
-    "ver",
-    "nokon",
-    "gjere",
-    "høgre",
-    "vidare",
-    "betre",
-    "ifrå",
-    "handlar",
-    "kommunane",
-    "utan",
-    "røysta",
-    "røystar",
-    "vegner",
-    "synest",
-    "fleirtal",
-    "kommunar",
-    "sidan",
-    "tidlegare",
-    "kvar",
-    "sit",
-    "tydeleg",
-    "éin",
-    "eitt",
-    "arbeidsplassar",
-    "gong",
-    "saman",
-    "gjera",
-    "treng",
-    "veg",
-    "millionar",
-    "einig",
-    "allereie",
-    "pengar",
-    "innanfor",
-    "særleg",
-    "eigentleg",
-    "fekk",
-    "kunna",
-    "korfor",
-    "einige",
-    "krevjande",
-    "eigen",
-    "voterast",
-    "viktigaste",
-    "ressursane",
-    "alvorleg",
-    "vanskeleg",
-    "fleirtalet",
-    "utfordringar",
-    "ressursar",
-    "høgare",
-    "tilstrekkeleg",
-    "deira",
-    "forbod",
-    "sivilombodsmannen",
-    "eigne",
-    "reforma",
-    "dårleg",
-    "framstegspartiet",
-    "finst",
-    "eige",
-    "aukar",
-    "utanfor",
-    "nokre",
-    "verda",
-    "delar",
-    "politireforma",
-    "snakkar",
-    "gonger",
-    "takkar",
-    "innan",
-    "difor",
-    "sjølvsagt",
-    "kvifor",
-    "kome",
-    "høyrer",
-    "kristeleg",
-    "eigarskap",
-    "seinare",
-    "håpar",
-    "verkeleg",
-    "saksordførar",
-    "bidreg",
-    "raudt",
-    "innbyggarane",
-    "antal",
-    "ynskjer",
-    "set",
-    "annan",
-    "vanlege",
-    "løysingar",
-    "milliardar",
-    "dyrevelferda",
-    "forventar",
-    "verkemiddel",
-    "høyring",
-    "føreslå",
-    "konsesjonslova",
-    "bygga",
-    "tenester",
-    "noregs",
-    "aktørar",
-    "jobbar",
-    "sterkare",
-    "kven",
-    "eine",
-    "sikrar",
-    "gruppehald",
-    "berekraftig",
-    "vesentleg",
-    "betydeleg",
-    "legga",
-    "stortingsfleirtalet",
-    "fornøgd",
-    "usikkerheit",
-    "pasientar",
-    "nemleg",
-    "høyrt",
-    "val",
-    "vedteke",
-    "tener",
-    "oppgåver",
-    "hovudsak",
-    "vurderingar",
-    "offentleg",
-    "endringane",
-    "framleis",
-    "takka",
-    "endå",
-    "halde",
-    "utfordringane",
-    "samarbeidspartia",
-    "trengst",
-    "forhandlingane",
-    "kystsamfunna",
-    "følgt",
-    "verkar",
-    "skapa",
-    "verdiar",
-    "offentlege",
-    "investeringar",
-    "einaste",
-    "konsekvensane",
-    "skikkeleg",
-    "gjekk",
-    "omfattande",
-    "avgjerande",
-    "talarstolen",
-    "statlege",
-    "svara",
-    "tilbod",
-    "lesa",
-    "nord-noreg",
-    "soldatar",
-    "spørje",
-    "brukar",
-    "staden",
-    "pasientane",
-    "eigedomar",
-    "konsekvensar",
-    "faglege",
-    "finna",
-    "ytterlegare",
-    "mogleg",
-    "openbert",
-    "eiga",
-    "innbyggarar",
-    "manglar",
-    "innbyggjarane",
-    "pengane",
-    "såkalla",
-    "reglar",
-    "utanlandske",
-    "personar",
-    "sjølvstendig",
-    "folkevalde",
-    "seia",
-    "støttar",
-    "representantane",
-    "koma",
-    "vedtaka",
-    "vedteken",
-    "parkane",
-    "brukast",
-    "nemnde",
-    "enklare",
-    "utvalet",
-    "tal",
-    "stortingsrepresentantane",
-    "naturleg",
-    "forsvarleg",
-    "fiskarar",
-    "eigedom",
-    "tilsvarande",
-    "setta",
-    "breitt",
-    "gjerast",
-    "låg",
-    "fortsetta",
-    "teke",
-    "tala",
-    "byane",
-    "samstundes",
-    "valt",
-    "dårlegare",
-    "næringar",
-    "refererast",
-    "regionalparkar",
-    "politikarar",
-    "aukande",
-    "viktigare",
-    "resultata",
-]
+# bump when the parsed utterances change, so that cached speaker files are parsed again
+nst_parser_version = 1
 
-
-def pred_nynorsk(sent, wl):
-    lang = "nb-NO"
-    for word in sent.lower().split(" "):
-        if word in wl:
-            lang = "nn-NO"
-            break
-    return lang
+nst_nynorsk = nynorsk_detector(nynorsk_words)
 
 
 def get_audio_duration(filename):
-    # returns: duration in seconds
-    with wave.open(filename) as f_open:
-        duration = f_open.getnframes() / f_open.getframerate()
-    return duration
+    # returns: duration in seconds, reading only the header of the file
+    return get_wav_duration(filename)
 
 
 def get_nst_dialect(rob, roy):
@@ -284,114 +46,153 @@ def get_nst_dialect(rob, roy):
         return "unknown"
 
 
-def parse_nst(nst_path, channel="1", verbose=False):
-    '''By default, the path to the audio from channel 1 is given.
-    For channel 2, channel="2", and for stereo, channel="begge"'''
+def parse_nst_speaker_file(
+    file, dataset, audio_path, dataset_prefix="nst_", prober=None
+):
+    '''Parse the utterances of one NST speaker json file of dataset (ADB_NOR_0463 or ADB_NOR_0464).
+    The durations are read from the headers of the audio files by prober, a wav_duration_prober.
+    Returns the utterances and the number of audio files found and missing'''
+    if prober is None:
+        prober = wav_duration_prober(workers=1)
+    found_audio_files = 0
+    missing_audio_files = 0
+    parsed_set = []
+    with open(file, "r") as read_file:
+        data = json.load(read_file)
+    if "val_recordings" in data.keys():
+        speaker_id = data["info"]["Speaker_ID"]
+        sex = data["info"]["Sex"]
+        age = data["info"]["Age"]
+        pid = data["pid"]
+        region_of_birth = data["info"]["Region_of_Birth"]
+        region_of_youth = data["info"]["Region_of_Youth"]
+        sex = sex.lower() if sex in ["Female", "Male"] else "unknown"
+        path_list = []
+        wav_list = []
+        # wav file names and transcriptions, read straight from the recordings
+        recordings = [
+            (recording["file"], recording["text"])
+            for recording in data["val_recordings"]
+        ]
+        for file, text in recordings:
+            fn_raw = file.split(".")[0]
+            path_list.append(
+                os.path.join(audio_path, pid, pid + "_" + fn_raw + "-1.wav")
+            )
+            wav_list.append(fn_raw + "-1.wav")
+        # the headers of all the audio files of the speaker are read at once
+        durations = prober.durations(path_list)
+        languages = nst_nynorsk.predict_batch([text for file, text in recordings])
+        for (file, text), file_path, duration, language in zip(
+            recordings, path_list, durations, languages
+        ):
+            fn_raw = file.split(".")[0]
+            found_audio_files += 1
+            if duration is None:
+                missing_audio_files += 1
+                continue
+            parsed_set.append(
+                consolidated_utterance(
+                    dataset_prefix + speaker_id,
+                    sex,
+                    dataset_prefix + fn_raw,
+                    language,
+                    text,
+                    file_path,
+                    dataset_prefix + "train"
+                    if dataset == "ADB_NOR_0463"
+                    else dataset_prefix + "test",
+                    get_nst_dialect(region_of_birth, region_of_youth),
+                    duration,
+                    0,
+                    duration,
+                    file_path,
+                )
+            )
+    return parsed_set, found_audio_files, missing_audio_files
+
+
+def iter_nst(
+    nst_path,
+    channel="1",
+    verbose=False,
+    cache_dir=None,
+    probe_workers=8,
+    dedup_keys=("audio_path",),
+):
+    '''Generator version of parse_nst, yields the utterances one speaker json file at a time.
+    The train set (ADB_NOR_0463) is parsed first, and test utterances whose audio file
+    is also in the train set are skipped. dedup_keys are the keys the test utterances are
+    matched on, "audio_path" (the audio file relative to the audio folder) and/or
+    "speaker_text" (the speaker and prompt text), see split_deduplicator.
+    By default, the path to the audio from channel 1 is given.
+    For channel 2, channel="2", and for stereo, channel="begge"
+    With a cache_dir the parsed speaker files are stored there and only new or modified
+    ones are parsed again, see parse_cache. The audio files are only checked when a speaker
+    file is parsed, so clear the cache after adding or replacing audio files.
+    The durations are read from the headers of the audio files in probe_workers threads,
+    and also cached in cache_dir/wav_durations.pkl, see wav_duration_prober.'''
     datasets = ["ADB_NOR_0463", "ADB_NOR_0464"]
     audio_path = os.path.join(nst_path, f"lydfiler_16_{channel}/no/")
-    final_results = []
     found_audio_files = 0
     missing_audio_files = 0
     dataset_prefix = "nst_"
-    for dataset in datasets:
-        for root, dirs, files in os.walk(os.path.join(nst_path, dataset)):
-            for name in files:
-                if name.endswith("json"):
-                    file = os.path.join(root, name)
-                    # print(f"processing json file: {file}")
-                    with open(file, "r") as read_file:
-                        data = json.load(read_file)
-                    if "val_recordings" in data.keys():
-                        speaker_id = data["info"]["Speaker_ID"]
-                        sex = data["info"]["Sex"]
-                        age = data["info"]["Age"]
-                        pid = data["pid"]
-                        region_of_birth = data["info"]["Region_of_Birth"]
-                        region_of_youth = data["info"]["Region_of_Youth"]
-                        df_full = pd.json_normalize(data, "val_recordings")
-                        df = df_full.drop(
-                            labels=[
-                                "DST",
-                                "NOI",
-                                "QUA",
-                                "SND",
-                                "SPC",
-                                "UTT",
-                                "t0",
-                                "t1",
-                                "t2",
-                                "type",
-                            ],
-                            axis="columns",
+    cache = parse_cache(cache_dir, "nst", nst_parser_version)
+    dedup = split_deduplicator(
+        dataset_prefix + "train", keys=dedup_keys, audio_root=audio_path
+    )
+    with wav_duration_prober(
+        None if cache_dir is None else os.path.join(cache_dir, "wav_durations.pkl"),
+        workers=probe_workers,
+    ) as prober:
+        for dataset in datasets:
+            for root, dirs, files in os.walk(os.path.join(nst_path, dataset)):
+                for name in files:
+                    if name.endswith("json"):
+                        file = os.path.join(root, name)
+                        # print(f"processing json file: {file}")
+                        parsed_set, found, missing = cache.get(
+                            [file],
+                            parse_nst_speaker_file,
+                            file,
+                            dataset,
+                            audio_path,
+                            prober=prober,
+                            params=(dataset, audio_path),
                         )
-                        df["speaker_id"] = speaker_id
-                        df["sex"] = sex
-                        df["age"] = age
-                        df["dataset"] = "NST"
-                        sex = sex.lower() if sex in ["Female", "Male"] else "unknown"
-                        path_list = []
-                        wav_list = []
-                        parsed_set = []
-                        for row in df.itertuples():
-                            file = row[1]  # wav file names
-                            text = row[2]  # transcriptions
-                            fn_raw = file.split(".")[0]
-                            file_path = os.path.join(
-                                audio_path, pid, pid + "_" + fn_raw + "-1.wav"
-                            )
-                            try:
-                                found_audio_files += 1
-                                path_list.append(file_path)
-                                wav_list.append(fn_raw + "-1.wav")
-                                duration = get_audio_duration(file_path)
-                                parsed_set.append(
-                                    consolidated_utterance(
-                                        dataset_prefix + speaker_id,
-                                        sex,
-                                        dataset_prefix + fn_raw,
-                                        pred_nynorsk(text, words_nn),
-                                        text,
-                                        file_path,
-                                        dataset_prefix + "train"
-                                        if dataset == "ADB_NOR_0463"
-                                        else dataset_prefix + "test",
-                                        get_nst_dialect(
-                                            region_of_birth, region_of_youth
-                                        ),
-                                        duration,
-                                        0,
-                                        duration,
-                                        file_path,
-                                    )
-                                )
-                            except FileNotFoundError:
-                                missing_audio_files += 1
-                        final_results.extend(parsed_set)
+                        found_audio_files += found
+                        missing_audio_files += missing
+                        yield from dedup(parsed_set)
     if verbose:
         logging.info(
             f"NST audio files found: {found_audio_files}\nNST audio files missing: {missing_audio_files}"
         )
-        logging.info("checking for duplicates of train in test...")
-    duplicates = 0
-    audios_in_train = [
-        x.audio_file
-        for x in final_results
-        if x.original_data_split == dataset_prefix + "train"
-    ]
-    cleaned_results = []
-    for r in final_results:
-        if r.original_data_split == dataset_prefix + "train":
-            cleaned_results.append(r)
-        else:
-            if r.audio_file not in audios_in_train:
-                cleaned_results.append(r)
-            else:
-                duplicates += 1
-    if verbose:
-        logging.info(
-            f"{duplicates} duplicate files in test and train removed from test"
+        dedup.log_summary()
+    cache.log_summary()
+
+
+def parse_nst(
+    nst_path,
+    channel="1",
+    verbose=False,
+    cache_dir=None,
+    probe_workers=8,
+    dedup_keys=("audio_path",),
+):
+    '''By default, the path to the audio from channel 1 is given.
+    For channel 2, channel="2", and for stereo, channel="begge".
+    With a cache_dir only new or modified speaker files are parsed, and test utterances
+    are matched against the train set on dedup_keys, see iter_nst'''
+    return list(
+        iter_nst(
+            nst_path,
+            channel=channel,
+            verbose=verbose,
+            cache_dir=cache_dir,
+            probe_workers=probe_workers,
+            dedup_keys=dedup_keys,
         )
-    return cleaned_results
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+# Frequent Nynorsk words that are not (or rarely) Bokmål. A sentence is labelled as Nynorsk
+# if it contains any of them
+nynorsk_words = frozenset(
+    [
+    "ein",
+    "dei",
+    "ikkje",
+    "eg",
+    "eit",
+    "me",
+    "frå",
+    "då",
+    "noreg",
+    "kva",
+    "meir",
+    "vere",
+    "talar",
+    "fleire",
+    "gjer",
+    "noko",
+    "arbeidarpartiet",
+    "korleis",
+    "desse",
+    "ver",
+    "nokon",
+    "gjere",
+    "høgre",
+    "vidare",
+    "betre",
+    "ifrå",
+    "handlar",
+    "kommunane",
+    "utan",
+    "røysta",
+    "røystar",
+    "vegner",
+    "synest",
+    "fleirtal",
+    "kommunar",
+    "sidan",
+    "tidlegare",
+    "kvar",
+    "sit",
+    "tydeleg",
+    "éin",
+    "eitt",
+    "arbeidsplassar",
+    "gong",
+    "saman",
+    "gjera",
+    "treng",
+    "veg",
+    "millionar",
+    "einig",
+    "allereie",
+    "pengar",
+    "innanfor",
+    "særleg",
+    "eigentleg",
+    "fekk",
+    "kunna",
+    "korfor",
+    "einige",
+    "krevjande",
+    "eigen",
+    "voterast",
+    "viktigaste",
+    "ressursane",
+    "alvorleg",
+    "vanskeleg",
+    "fleirtalet",
+    "utfordringar",
+    "ressursar",
+    "høgare",
+    "tilstrekkeleg",
+    "deira",
+    "forbod",
+    "sivilombodsmannen",
+    "eigne",
+    "reforma",
+    "dårleg",
+    "framstegspartiet",
+    "finst",
+    "eige",
+    "aukar",
+    "utanfor",
+    "nokre",
+    "verda",
+    "delar",
+    "politireforma",
+    "snakkar",
+    "gonger",
+    "takkar",
+    "innan",
+    "difor",
+    "sjølvsagt",
+    "kvifor",
+    "kome",
+    "høyrer",
+    "kristeleg",
+    "eigarskap",
+    "seinare",
+    "håpar",
+    "verkeleg",
+    "saksordførar",
+    "bidreg",
+    "raudt",
+    "innbyggarane",
+    "antal",
+    "ynskjer",
+    "set",
+    "annan",
+    "vanlege",
+    "løysingar",
+    "milliardar",
+    "dyrevelferda",
+    "forventar",
+    "verkemiddel",
+    "høyring",
+    "føreslå",
+    "konsesjonslova",
+    "bygga",
+    "tenester",
+    "noregs",
+    "aktørar",
+    "jobbar",
+    "sterkare",
+    "kven",
+    "eine",
+    "sikrar",
+    "gruppehald",
+    "berekraftig",
+    "vesentleg",
+    "betydeleg",
+    "legga",
+    "stortingsfleirtalet",
+    "fornøgd",
+    "usikkerheit",
+    "pasientar",
+    "nemleg",
+    "høyrt",
+    "val",
+    "vedteke",
+    "tener",
+    "oppgåver",
+    "hovudsak",
+    "vurderingar",
+    "offentleg",
+    "endringane",
+    "framleis",
+    "takka",
+    "endå",
+    "halde",
+    "utfordringane",
+    "samarbeidspartia",
+    "trengst",
+    "forhandlingane",
+    "kystsamfunna",
+    "følgt",
+    "verkar",
+    "skapa",
+    "verdiar",
+    "offentlege",
+    "investeringar",
+    "einaste",
+    "konsekvensane",
+    "skikkeleg",
+    "gjekk",
+    "omfattande",
+    "avgjerande",
+    "talarstolen",
+    "statlege",
+    "svara",
+    "tilbod",
+    "lesa",
+    "nord-noreg",
+    "soldatar",
+    "spørje",
+    "brukar",
+    "staden",
+    "pasientane",
+    "eigedomar",
+    "konsekvensar",
+    "faglege",
+    "finna",
+    "ytterlegare",
+    "mogleg",
+    "openbert",
+    "eiga",
+    "innbyggarar",
+    "manglar",
+    "innbyggjarane",
+    "pengane",
+    "såkalla",
+    "reglar",
+    "utanlandske",
+    "personar",
+    "sjølvstendig",
+    "folkevalde",
+    "seia",
+    "støttar",
+    "representantane",
+    "koma",
+    "vedtaka",
+    "vedteken",
+    "parkane",
+    "brukast",
+    "nemnde",
+    "enklare",
+    "utvalet",
+    "tal",
+    "stortingsrepresentantane",
+    "naturleg",
+    "forsvarleg",
+    "fiskarar",
+    "eigedom",
+    "tilsvarande",
+    "setta",
+    "breitt",
+    "gjerast",
+    "låg",
+    "fortsetta",
+    "teke",
+    "tala",
+    "byane",
+    "samstundes",
+    "valt",
+    "dårlegare",
+    "næringar",
+    "refererast",
+    "regionalparkar",
+    "politikarar",
+    "aukande",
+    "viktigare",
+    "resultata",
+    ]
+)
+
+# Words that are only counted as Nynorsk in NB Tale
+nbtale_nynorsk_words = nynorsk_words | frozenset(
+    [
+        "kor",
+        "vera",
+        "ligg",
+        "same",
+        "vert",
+        "kvart",
+        "knytt",
+        "bruka",
+        "atomvåpen",
+        "såg",
+        "finn",
+        "skriv",
+        "trass",
+        "utsett",
+        "vegen",
+        "krev",
+    ]
+)
+
+
+class nynorsk_detector:
+    """Labels sentences as Nynorsk ("nn-NO") or Bokmål ("nb-NO") by looking up their
+    lowercased words in a frozenset of Nynorsk words. A sentence is Nynorsk if it has
+    at least one of the words; score() gives the share of its words that are Nynorsk
+    instead of the label.
+
+        detector = nynorsk_detector(nbtale_nynorsk_words)
+        languages = detector.predict_batch(sentences)
+        scores = detector.predict_batch(sentences, scores=True)
+    """
+
+    def __init__(self, words=nynorsk_words):
+        self.words = frozenset(words)
+
+    def predict(self, sentence):
+        if self.words.isdisjoint(sentence.lower().split(" ")):
+            return "nb-NO"
+        return "nn-NO"
+
+    def score(self, sentence):
+        tokens = [token for token in sentence.lower().split(" ") if token]
+        if not tokens:
+            return 0.0
+        return sum(token in self.words for token in tokens) / len(tokens)
+
+    def predict_batch(self, sentences, scores=False):
+        """Labels (or scores, with scores=True) of all the sentences, in order"""
+        if scores:
+            return [self.score(sentence) for sentence in sentences]
+        return [self.predict(sentence) for sentence in sentences]
+
+
+def pred_nynorsk(sent, wl=nynorsk_words):
+    """Label of one sentence with the Nynorsk words wl"""
+    return nynorsk_detector(wl).predict(sent)
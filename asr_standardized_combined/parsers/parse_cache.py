@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class parse_cache:
+    """On-disk cache of the parsed units of a corpus (an NPSC session, an NST speaker json,
+    a Rundkast .trs/.lab pair, an NB Tale .trans file...). Each unit is stored as a pickle
+    in cache_dir/name/, keyed by the path, size and modification time of its source files,
+    the parser version and any extra parameters of the parser, so that only new or modified
+    units are parsed again. Bump the version of a parser when its output changes.
+    With cache_dir=None nothing is cached and get() just calls the parse function.
+
+        cache = parse_cache(cache_dir, "npsc", npsc_parser_version)
+        utterances = cache.get([token_file, sentence_file], parse_session, session_dir)
+        cache.log_summary()
+    """
+
+    def __init__(self, cache_dir, name, version):
+        self.cache_dir = None if cache_dir is None else os.path.join(cache_dir, name)
+        self.name = name
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, paths, params=()):
+        """Hash of the version, the parameters and the path, size and mtime of each source file"""
+        key = hashlib.sha1(repr((self.version, params)).encode())
+        for path in paths:
+            stat = os.stat(path)
+            key.update(
+                repr((os.path.abspath(path), stat.st_size, stat.st_mtime_ns)).encode()
+            )
+        return key.hexdigest()
+
+    def get(self, paths, parse, *args, params=(), **kwargs):
+        """Returns parse(*args, **kwargs), loaded from the cache if the source files in paths
+        haven't changed since it was stored, otherwise parsed and stored"""
+        if self.cache_dir is None:
+            return parse(*args, **kwargs)
+        filename = os.path.join(self.cache_dir, self.key(paths, params) + ".pkl")
+        try:
+            with open(filename, "rb") as f_open:
+                result = pickle.load(f_open)
+            self.hits += 1
+            return result
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # e.g. a truncated pickle, or a pickle of a class that has since been moved or
+            # changed: the unit is parsed again and its entry overwritten
+            logger.debug(
+                "Parse cache {}: could not load {}, parsing it again ({!r})".format(
+                    self.name, filename, e
+                )
+            )
+        result = parse(*args, **kwargs)
+        self.misses += 1
+        # written to a temporary file first, so that parallel parsers never read half a pickle
+        fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f_open:
+                pickle.dump(result, f_open, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+        os.replace(tmp_filename, filename)
+        return result
+
+    def log_summary(self):
+        if self.cache_dir is not None:
+            logger.info(
+                "Parse cache {}: {} units loaded from the cache, {} parsed".format(
+                    self.name, self.hits, self.misses
+                )
+            )
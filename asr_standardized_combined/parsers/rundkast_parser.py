@@ -1,14 +1,23 @@
 import pandas as pd
 import csv
+import os
 import re
+from functools import partial
+from itertools import zip_longest
+from multiprocessing import Pool
 import numpy as np
 from pathlib import Path
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from lxml import etree
+from .parse_cache import parse_cache
 from .shared_classes import consolidated_utterance, consolidated_utterance_phon
-from pympi.Praat import TextGrid
+from .textgrid_utils import read_textgrid_tiers
+from dataclasses import fields
 import warnings
 
 
+# bump when the parsed transcriptions change, so that cached files are parsed again
+rundkast_parser_version = 1
+
 # Regex patterns
 
 bg_level_pattern = re.compile(r"level=([a-z]+)")
@@ -96,6 +105,35 @@ def make_linedict(line):
     return mydict
 
 
+def read_lab_file(labfile):
+    """Read a .lab file into a DataFrame with the same columns and dtypes as a DataFrame
+    of make_linedict of each line. The lines are transposed into columns once and the
+    attributes extracted from whole columns, so no dict is built per line"""
+    with Path(labfile).open(mode="r", newline="") as csvfile:
+        lines = list(csv.reader(csvfile, delimiter="\t"))
+    lengths = pd.Series([len(line) for line in lines])
+    columns = list(zip_longest(*lines))
+    # lines shorter than 5 fields are padded with None
+    columns += [(None,) * len(lines)] * (5 - len(columns))
+    attributes = {
+        "start": pd.Series(columns[0], dtype=object),
+        "transcription": pd.Series(columns[1], dtype=object).where(lengths > 2),
+    }
+    # the attributes are only read from lines with all 5 fields
+    for column, patterns in zip(
+        columns[2:5], [background_patterns, turn_patterns, segment_patterns]
+    ):
+        field = pd.Series(column, dtype=object).where(lengths == 5)
+        for k, pattern in patterns.items():
+            attributes[k] = field.str.extract(pattern, expand=False)
+    # built from object arrays and columns without any value made float, so that the
+    # dtypes are inferred as in a DataFrame of dicts
+    df = pd.DataFrame(
+        {k: column.to_numpy(dtype=object) for k, column in attributes.items()}
+    )
+    return df.infer_objects()
+
+
 def get_language(accent):
     if re.match(".*bokmål.*", accent):
         return "nb-NO"
@@ -135,70 +173,266 @@ def clean_dialect(dialectstring):
     return dialect
 
 
-def parse_corpus_files(rundkastdir):
-    """Specify the root directory of Rundkast and produce a DataFrame of the Rundkast data"""
+def _read_trs_header_soup(trsfile):
+    """read_trs_header with BeautifulSoup, for .trs files that are not well-formed XML"""
+    from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+
+    # BeatifulSoup produces warnings. Probably a bug
+    warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+    with Path(trsfile).open(mode="r") as trs_file:
+        trs = trs_file.read()
+    soup = BeautifulSoup(trs, "lxml")
+    topics = []
+    for t in soup.topics:
+        if t.name == "topic":
+            topics.append(t.attrs)
+    speakers = []
+    for s in soup.speakers:
+        if s.name == "speaker":
+            speakers.append(s.attrs)
+    return topics, speakers
+
+
+def read_trs_header(trsfile, chunk_size=1 << 16):
+    """Read the topics and speakers of a .trs file as lists of attribute dicts, with the
+    tag and attribute names lowercased as by BeautifulSoup's HTML parser. The file is
+    parsed incrementally and only until the end of its <Topics> and <Speakers> sections,
+    which come before the (long) <Episode>. Falls back to BeautifulSoup if the file is
+    not well-formed XML"""
+    sections = {"topics": ("topic", []), "speakers": ("speaker", [])}
+    done = set()
+    parser = etree.XMLPullParser(events=("start", "end"))
+    open_sections = []
+    try:
+        # read as text, like the rest of the parser, so the encoding declaration is ignored
+        with Path(trsfile).open(mode="r") as trs_file:
+            while len(done) < len(sections):
+                chunk = trs_file.read(chunk_size)
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    # the file ended before both sections were closed: close() raises
+                    # XMLSyntaxError if the file is truncated or unclosed
+                    parser.close()
+                for event, element in parser.read_events():
+                    if not isinstance(element.tag, str):
+                        continue  # comments and processing instructions
+                    tag = element.tag.lower()
+                    if event == "start":
+                        if tag in sections and tag not in done:
+                            open_sections.append(element)
+                        continue
+                    if open_sections and element is open_sections[-1]:
+                        open_sections.pop()
+                        done.add(tag)
+                    elif open_sections and element.getparent() is open_sections[-1]:
+                        name, items = sections[open_sections[-1].tag.lower()]
+                        if tag == name:
+                            attrs = {}
+                            for key, value in element.attrib.items():
+                                attrs.setdefault(key.lower(), value)
+                            items.append(attrs)
+                if not chunk:
+                    break
+    except etree.XMLSyntaxError:
+        return _read_trs_header_soup(trsfile)
+    return sections["topics"][1], sections["speakers"][1]
+
+
+# Columns identifying a speaker across files, and a segment within the corpus
+speaker_columns = ["name", "check", "type", "dialect", "accent", "scope", "language"]
+segment_columns = ["start", "end", "transcription", "full_audio_file"]
+
+
+def row_codes(df, columns, dropna=True):
+    """Integer code of each row of df[columns], with equal rows getting the same code
+    and the codes numbered in order of first appearance. The columns are factorized one
+    at a time and their codes combined, so no row tuples are built or compared.
+    With dropna, rows with a missing value get -1 and are not numbered, otherwise a
+    missing value is compared like any other value"""
+    codes = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        column_codes, uniques = pd.factorize(df[column])
+        missing |= column_codes < 0
+        # the codes stay below the number of rows, so the product fits in an int64
+        codes, _ = pd.factorize(codes * (len(uniques) + 1) + column_codes + 1)
+    if not dropna:
+        return codes
+    present = ~missing
+    codes[present], _ = pd.factorize(codes[present])
+    codes[missing] = -1
+    return codes
+
+
+def parse_corpus_file(trsfile, labfile):
+    """Produce a DataFrame of one Rundkast transcription, given its .trs and .lab files.
+    The speaker ids and sentence ids are only made consistent across files by
+    parse_corpus_files and iter_rundkast"""
+
+    audiofile = Path(Path(trsfile).stem + ".wav")
+    df = read_lab_file(labfile)
+    df.loc[:, "end"] = df.start.shift(-1)
+    df.loc[:, "transcription_file"] = Path(labfile).name
+    df.loc[:, "full_audio_file"] = audiofile.name
+    df.drop(df.tail(1).index, inplace=True)  # last line contains endtime only
+    df = df.astype(
+        {
+            "start": float,
+            "background_start": float,
+            "turn_start": float,
+            "turn_end": float,
+            "segment_start": float,
+            "segment_end": float,
+            "end": float,
+        }
+    )
+    topics, speakers = read_trs_header(trsfile)
+    for s in speakers:
+        s["language"] = get_language(s["accent"])
+    topics_df = pd.DataFrame(topics)
+    topics_df.loc[:, "desc"] = topics_df.desc.apply(lambda x: normalize_topics(x))
+    speakers_df = pd.DataFrame(speakers)
+    speakers_df.loc[:, "accent"] = speakers_df.accent.apply(
+        lambda x: clean_dialect(x)
+    )
+    df = df.merge(speakers_df, left_on="turn_speaker", right_on="id", how="left")
+    df = df.merge(topics_df, left_on="segment_topic", right_on="id", how="left")
+    return df
+
+
+def corpus_file_pairs(rundkastdir):
+    """List the (.trs, .lab) file pairs of the Rundkast transcriptions"""
 
     transcriptiondir = Path(rundkastdir) / "transcription"
 
     trsdir = transcriptiondir / "trs"
     labdir = transcriptiondir / "lab"
 
-    # BeatifulSoup produces warnings. Probably a bug
-    warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
     allstems = [x.stem for x in Path(trsdir).glob("*.trs")]
-    all_datasets = []
-
-    # Loop through the .lab and .trs files
-    for stem in allstems:
-        trsfile = Path(trsdir) / (stem + ".trs")
-        labfile = Path(labdir) / (stem + ".lab")
-        audiofile = Path(stem + ".wav")
-        lines = []
-        with labfile.open(mode="r", newline="") as csvfile:
-            reader = csv.reader(csvfile, delimiter="\t")
-            for r in reader:
-                lines.append(r)
-        linedicts = [make_linedict(l) for l in lines]
-        df = pd.DataFrame(linedicts)
-        df.loc[:, "end"] = df.start.shift(-1)
-        df.loc[:, "transcription_file"] = labfile.name
-        df.loc[:, "full_audio_file"] = audiofile.name
-        df.drop(df.tail(1).index, inplace=True)  # last line contains endtime only
-        df = df.astype(
-            {
-                "start": float,
-                "background_start": float,
-                "turn_start": float,
-                "turn_end": float,
-                "segment_start": float,
-                "segment_end": float,
-                "end": float,
-            }
-        )
-        with trsfile.open(mode="r") as trs_file:
-            trs = trs_file.read()
-        soup = BeautifulSoup(trs, "lxml")
-        topics = []
-        for t in soup.topics:
-            if t.name == "topic":
-                topics.append(t.attrs)
-        speakers = []
-        for s in soup.speakers:
-            if s.name == "speaker":
-                speakers.append(s.attrs)
-        for s in speakers:
-            s["language"] = get_language(s["accent"])
-        topics_df = pd.DataFrame(topics)
-        topics_df.loc[:, "desc"] = topics_df.desc.apply(lambda x: normalize_topics(x))
-        speakers_df = pd.DataFrame(speakers)
-        speakers_df.loc[:, "accent"] = speakers_df.accent.apply(
-            lambda x: clean_dialect(x)
+    return [
+        (Path(trsdir) / (stem + ".trs"), Path(labdir) / (stem + ".lab"))
+        for stem in allstems
+    ]
+
+
+class column_buffers:
+    """Concatenates DataFrames into one array per column, grown as the DataFrames are
+    appended, so that only the DataFrame being appended is held alongside the table,
+    instead of all of them until a pd.concat. Float columns are kept as float arrays,
+    the others as object arrays. to_frame() gives the same DataFrame as
+    pd.concat(dataframes, ignore_index=True)"""
+
+    def __init__(self):
+        self.columns = {}
+        self.length = 0
+        self.capacity = 0
+        # one row per DataFrame, with a value of each column if it has any, from which
+        # pd.concat gives the dtypes of the concatenated columns
+        self.samples = []
+
+    def _grow(self, length):
+        # the capacity doubles, so that each row is copied a bounded number of times
+        self.capacity = max(length, 2 * self.capacity)
+        for name, array in self.columns.items():
+            grown = np.empty(self.capacity, dtype=array.dtype)
+            grown[: self.length] = array[: self.length]
+            self.columns[name] = grown
+
+    def append(self, df):
+        start, end = self.length, self.length + len(df)
+        if end > self.capacity:
+            self._grow(end)
+        sample = {}
+        for name in df.columns:
+            column = df[name]
+            values = column.to_numpy()
+            if values.dtype != np.float64:
+                values = column.to_numpy(dtype=object)
+            array = self.columns.get(name)
+            if array is None:
+                # the rows of the DataFrames appended before have no value
+                array = np.full(self.capacity, np.nan, dtype=values.dtype)
+            elif array.dtype != values.dtype:
+                array = array.astype(object)
+            array[start:end] = values
+            self.columns[name] = array
+            valid = column.dropna()
+            sample[name] = (valid if len(valid) else column).iloc[:1].reset_index(
+                drop=True
+            )
+        for name, array in self.columns.items():
+            if name not in df.columns:
+                array[start:end] = np.nan
+        self.samples.append(
+            pd.DataFrame(sample, columns=df.columns, index=pd.RangeIndex(min(len(df), 1)))
         )
-        df = df.merge(speakers_df, left_on="turn_speaker", right_on="id", how="left")
-        df = df.merge(topics_df, left_on="segment_topic", right_on="id", how="left")
-        all_datasets.append(df)
-
-    full_corpus_df = pd.concat(all_datasets)
+        self.length = end
+
+    def to_frame(self):
+        dtypes = pd.concat(self.samples, ignore_index=True).dtypes
+        # one column at a time, so that the arrays are released as they are converted
+        columns = {}
+        for name in list(self.columns):
+            array = self.columns.pop(name)
+            if len(array) > self.length:
+                array = array[: self.length].copy()
+            columns[name] = pd.Series(array, copy=False).astype(dtypes[name])
+            del array
+        return pd.DataFrame(columns, index=pd.RangeIndex(self.length), copy=False)
+
+
+def _parse_corpus_file_cached(pair, cache, transcribed_only=False):
+    # returns the DataFrame and the cache hits and misses of this .trs/.lab pair
+    trsfile, labfile = pair
+    hits, misses = cache.hits, cache.misses
+    df = cache.get([trsfile, labfile], parse_corpus_file, trsfile, labfile)
+    if transcribed_only:
+        df = df[~df.transcription.isna()]
+    return df, cache.hits - hits, cache.misses - misses
+
+
+def iter_corpus_files(rundkastdir, cache_dir=None, workers=1, transcribed_only=False):
+    """Yields the DataFrame of each Rundkast transcription, see parse_corpus_file.
+    With workers > 1 (None for one per CPU) the files are parsed in a pool of processes,
+    and still yielded in the same order. With transcribed_only the lines without a
+    transcription are dropped before a DataFrame is sent back from a process.
+    With a cache_dir only new or modified .trs/.lab pairs are parsed, see parse_cache"""
+    cache = parse_cache(cache_dir, "rundkast", rundkast_parser_version)
+    parse_file = partial(
+        _parse_corpus_file_cached, cache=cache, transcribed_only=transcribed_only
+    )
+    pairs = corpus_file_pairs(rundkastdir)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(pairs) < 2:
+        for pair in pairs:
+            df, _, _ = parse_file(pair)
+            yield df
+        cache.log_summary()
+        return
+    with Pool(processes=min(workers, len(pairs))) as pool:
+        # imap keeps the order of the files, and so the sentence ids
+        for df, hits, misses in pool.imap(parse_file, pairs):
+            cache.hits += hits
+            cache.misses += misses
+            yield df
+    cache.log_summary()
+
+
+def parse_corpus_files(rundkastdir, cache_dir=None, workers=1):
+    """Specify the root directory of Rundkast and produce a DataFrame of the Rundkast data.
+    With workers > 1 (None for one per CPU) the files are parsed in a pool of processes"""
+
+    # Loop through the .lab and .trs files. Only the transcribed lines are kept from each
+    # file, and each file is copied into the corpus columns as soon as it is parsed
+    corpus_columns = column_buffers()
+    for df in iter_corpus_files(
+        rundkastdir, cache_dir=cache_dir, workers=workers, transcribed_only=True
+    ):
+        corpus_columns.append(df)
+    full_corpus_df = corpus_columns.to_frame()
+    del corpus_columns
 
     # Clean the data
     full_corpus_df.loc[:, "segment_topic"] = full_corpus_df.loc[:, "desc"]
@@ -206,36 +440,15 @@ def parse_corpus_files(rundkastdir):
     full_corpus_df = full_corpus_df.drop(["id_x", "id_y", "desc"], axis=1)
     full_corpus_df.loc[:, "duration"] = full_corpus_df.end - full_corpus_df.start
 
-    # Make speaker information consistent across files
-    speakers = (
-        full_corpus_df[
-            ["name", "check", "type", "dialect", "accent", "scope", "language"]
-        ]
-        .dropna()
-        .drop_duplicates()
-    )
-    speakers.reset_index(drop=True, inplace=True)
-    speakers.loc[:, "identifier"] = speakers.index
-    speakers.loc[:, "speaker_id"] = speakers.loc[:, "identifier"].apply(
-        lambda x: f"speaker_{x}"
-    )
-    full_corpus_df = pd.merge(
-        full_corpus_df,
-        speakers[
-            [
-                "name",
-                "check",
-                "type",
-                "dialect",
-                "accent",
-                "scope",
-                "language",
-                "speaker_id",
-            ]
-        ],
-        on=["name", "check", "type", "dialect", "accent", "scope", "language"],
-        how="left",
-    ).drop_duplicates(subset=["start", "end", "transcription", "full_audio_file"])
+    # Make speaker information consistent across files: speakers are numbered in order of
+    # first appearance of their identity, rows with a missing identity value get no id
+    full_corpus_df = full_corpus_df.reset_index(drop=True)
+    identities = row_codes(full_corpus_df, speaker_columns)
+    full_corpus_df["speaker_id"] = (
+        "speaker_" + pd.Series(identities).astype(str)
+    ).where(identities >= 0)
+    segments = row_codes(full_corpus_df, segment_columns, dropna=False)
+    full_corpus_df = full_corpus_df[~pd.Series(segments).duplicated().to_numpy()]
     full_corpus_df.loc[:, "turn_speaker"] = full_corpus_df.speaker_id
 
     # Make sentence ids
@@ -265,60 +478,159 @@ def row_to_consolidated(row, audio_dir):
     )
 
 
-def parse_rundkast(rundkastdir):
-    """Parse Rundkast files and return a list of consolidated utterances"""
+def corpus_df_to_consolidated(df, audio_dir):
+    """Columnar version of row_to_consolidated: a DataFrame with the fields of
+    consolidated_utterance as columns, the same as a DataFrame of the consolidated
+    utterances of each row, built with whole-column operations"""
+    dataset_prefix = "rundkast_"
+    audio_prefix = str(Path(audio_dir)) + os.sep
+    columns = {
+        "speaker_id": dataset_prefix + df["speaker_id"].astype(str),
+        "speaker_gender": df["type"],
+        "sentence_id": dataset_prefix + df["sentence_id"].astype(str),
+        "sentence_language_code": df["language"],
+        "sentence_text_raw": df["transcription"],
+        "audio_file": audio_prefix + df["full_audio_file"],
+        "original_data_split": "rundkast",
+        "dialect": df["accent"].where(
+            df["accent"].map(lambda accent: type(accent) is str), "unknown"
+        ),
+        "sentence_duration_s": df["duration"],
+        "start_time": df["start"],
+        "end_time": df["end"],
+        "segmented_audio_file": "",
+    }
+    # built from object arrays, so that the dtypes are inferred as from the utterances
+    return pd.DataFrame(
+        {
+            field.name: pd.Series(columns[field.name], index=df.index).to_numpy(
+                dtype=object
+            )
+            for field in fields(consolidated_utterance)
+        }
+    ).infer_objects()
+
+
+def parse_rundkast(rundkastdir, cache_dir=None, workers=1, as_frame=False):
+    """Parse Rundkast files and return a list of consolidated utterances, or with
+    as_frame=True a DataFrame with the same columns as a DataFrame of the utterances,
+    which skips building an object per utterance, see corpus_df_to_consolidated.
+    With workers > 1 (None for one per CPU) the files are parsed in a pool of processes.
+    With a cache_dir only new or modified files are parsed, see parse_cache"""
 
     audiodir = Path(rundkastdir) / "audio"
 
-    df = parse_corpus_files(rundkastdir)
+    df = parse_corpus_files(rundkastdir, cache_dir=cache_dir, workers=workers)
+    if as_frame:
+        return corpus_df_to_consolidated(df, audiodir)
     return list(df.apply(lambda row: row_to_consolidated(row, audiodir), axis=1))
 
 
-def parse_rundkast_phon(rundkast_phon_dir):
+def iter_rundkast(rundkastdir, cache_dir=None, workers=1):
+    """Generator version of parse_rundkast, yields the consolidated utterances one
+    transcription file at a time. Speaker ids and sentence ids are assigned the same
+    way as in parse_corpus_files, keeping only the known speakers in memory.
+    With workers > 1 (None for one per CPU) the files are parsed in a pool of processes.
+    With a cache_dir only new or modified files are parsed, see parse_cache"""
 
-    audiodir = Path(rundkast_phon_dir) / "audio"
-    transdir = Path(rundkast_phon_dir) / "transcription"
+    audiodir = Path(rundkastdir) / "audio"
+    # speaker identity -> speaker id, in order of first appearance
+    speaker_ids = {}
+    # sentence ids are the positions of the utterances in the whole corpus
+    sentence_id = 0
+
+    for df in iter_corpus_files(
+        rundkastdir, cache_dir=cache_dir, workers=workers, transcribed_only=True
+    ):
+        df = df.reindex(columns=df.columns.union(speaker_columns, sort=False))
+
+        # Clean the data
+        df.loc[:, "segment_topic"] = df.loc[:, "desc"]
+        df = df[~df.transcription.isna()]
+        df = df.drop(["id_x", "id_y", "desc"], axis=1)
+        df.loc[:, "duration"] = df.end - df.start
+
+        # Make speaker information consistent across files
+        speakers = []
+        for identity in df[speaker_columns].itertuples(index=False, name=None):
+            if any(pd.isna(x) for x in identity):
+                speakers.append("unknown")
+            else:
+                speakers.append(
+                    speaker_ids.setdefault(identity, f"speaker_{len(speaker_ids)}")
+                )
+        df.loc[:, "speaker_id"] = speakers
+        df.loc[:, "turn_speaker"] = df.speaker_id
+
+        # Make sentence ids
+        df["sentence_id"] = range(sentence_id, sentence_id + len(df))
+        sentence_id += len(df)
+
+        df = df.drop_duplicates(subset=segment_columns)
+
+        # Handle missing values
+        df["language"] = df["language"].fillna("other")
+
+        for _, row in df.iterrows():
+            yield row_to_consolidated(row, audiodir)
+
+
+def parse_rundkast_phon_file(transfile, audiodir):
+    """Parse one Rundkast phon TextGrid into a consolidated_utterance_phon"""
 
     dataset_prefix = "rundkast_"
 
-    segment_list = []
-    for transfile in transdir.glob("*.TextGrid"):
-        stem = transfile.stem
-        audiofilename = stem + ".wav"
-        audiofilepath = audiodir / audiofilename
-
-        speaker_id = stem.split("_")[4]
-
-        tg = TextGrid(transfile)
-        utterance_ints = list(tg.get_tier("utterance").get_intervals())
-        start = float(0)
-        end = utterance_ints[-1][1]
-        text = " ".join([utt[2] for utt in utterance_ints if utt[2] != "..."])
-        wordlist = [
-            {"word": x[2], "start": x[0], "end": x[1]}
-            for x in tg.get_tier("word").get_intervals()
-            if x[2] != "..."
-        ]
-        phonelist = [
-            {"phone": x[2], "start": x[0], "end": x[1]}
-            for x in tg.get_tier("phoneme").get_intervals()
-            if x[2] != "..."
-        ]
-        segment_list.append(
-            consolidated_utterance_phon(
-                dataset_prefix + speaker_id,
-                phon_speakers[speaker_id][0],
-                dataset_prefix + stem,
-                "nb-NO",
-                text,
-                wordlist,
-                phonelist,
-                str(audiofilepath),
-                "rundkast_phon",
-                phon_speakers[speaker_id][1],
-                end,
-                start,
-                end,
-            )
-        )
-    return segment_list
+    stem = transfile.stem
+    audiofilename = stem + ".wav"
+    audiofilepath = audiodir / audiofilename
+
+    speaker_id = stem.split("_")[4]
+
+    tiers = read_textgrid_tiers(transfile, ["utterance", "word", "phoneme"])
+    utterance_ints = tiers["utterance"]
+    start = float(0)
+    end = utterance_ints[-1][1]
+    text = " ".join([utt[2] for utt in utterance_ints if utt[2] != "..."])
+    wordlist = [
+        {"word": x[2], "start": x[0], "end": x[1]}
+        for x in tiers["word"]
+        if x[2] != "..."
+    ]
+    phonelist = [
+        {"phone": x[2], "start": x[0], "end": x[1]}
+        for x in tiers["phoneme"]
+        if x[2] != "..."
+    ]
+    return consolidated_utterance_phon(
+        dataset_prefix + speaker_id,
+        phon_speakers[speaker_id][0],
+        dataset_prefix + stem,
+        "nb-NO",
+        text,
+        wordlist,
+        phonelist,
+        str(audiofilepath),
+        "rundkast_phon",
+        phon_speakers[speaker_id][1],
+        end,
+        start,
+        end,
+    )
+
+
+def parse_rundkast_phon(rundkast_phon_dir, workers=1):
+    """Parse the TextGrids of Rundkast phon into a list of consolidated_utterance_phon.
+    With workers > 1 (None for one per CPU) the files are parsed in a pool of processes,
+    the utterances are still returned in the same order"""
+
+    audiodir = Path(rundkast_phon_dir) / "audio"
+    transdir = Path(rundkast_phon_dir) / "transcription"
+
+    transfiles = list(transdir.glob("*.TextGrid"))
+    parse_file = partial(parse_rundkast_phon_file, audiodir=audiodir)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(transfiles) < 2:
+        return [parse_file(transfile) for transfile in transfiles]
+    with Pool(processes=min(workers, len(transfiles))) as pool:
+        return pool.map(parse_file, transfiles)
@@ -19,6 +19,17 @@ class consolidated_utterance:
     segmented_audio_file: str = ""
 
 
+class npsc_utterance(consolidated_utterance):
+    """consolidated_utterance that also keeps the NPSC tokens of the sentence as
+    (token_text, standardized_form, phon_ort_discrepancy) tuples. tokens is not a
+    dataclass field, so astuple() and the csv columns are the same as for a
+    consolidated_utterance"""
+
+    def __init__(self, *args, tokens=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tokens = tokens
+
+
 @dataclass
 class consolidated_utterance_phon:
     speaker_id: str
@@ -0,0 +1,94 @@
+import re
+
+# The same patterns as pympi's TextGrid reader, so that both read the same values
+float_pattern = re.compile(r"([\d.]+)\s*$", flags=re.UNICODE)
+int_pattern = re.compile(r"([\d]+)\s*$", flags=re.UNICODE)
+str_pattern = re.compile(
+    r'^[^"]*"((?:""|[^"])*)"\s*$', flags=re.UNICODE | re.DOTALL
+)
+
+
+class _textgrid_lines:
+    """Reads the values of a text TextGrid one line at a time"""
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def read_line(self):
+        return next(self.lines)
+
+    def read_float(self):
+        return float(float_pattern.search(self.read_line()).group(1))
+
+    def read_int(self):
+        return int(int_pattern.search(self.read_line()).group(1))
+
+    def read_str(self):
+        # a string can span several lines
+        line = self.read_line()
+        while True:
+            match = str_pattern.search(line)
+            if match:
+                return match.group(1).replace('""', '"')
+            line += self.read_line()
+
+
+def _read_textgrid_tiers_pympi(path, tier_names, codec):
+    """read_textgrid_tiers with pympi, for binary TextGrids"""
+    from pympi.Praat import TextGrid
+
+    tiers = {}
+    for tier in TextGrid(path, codec=codec).tiers:
+        if tier.name in tier_names and tier.name not in tiers:
+            tiers[tier.name] = list(tier.get_intervals())
+    return tiers
+
+
+def read_textgrid_tiers(path, tier_names, codec="utf-8"):
+    """Read the tiers named in tier_names from a Praat TextGrid, as a dict from tier name
+    to a list of (start, end, label) tuples ((time, label) for point tiers), the same
+    as pympi's TextGrid(path).get_tier(name).get_intervals(). If several tiers have the
+    same name, the first one is read. Tiers that are not in the file are left out.
+    Text TextGrids (normal and short format) are read line by line, skipping the
+    intervals of the other tiers and stopping once all the tiers are read, binary
+    TextGrids are read with pympi"""
+    tier_names = set(tier_names)
+    with open(path, "rb") as f_open:
+        if f_open.read(12) == b"ooBinaryFile":
+            return _read_textgrid_tiers_pympi(path, tier_names, codec)
+    tiers = {}
+    with open(path, "r", encoding=codec, newline="") as f_open:
+        values = _textgrid_lines(iter(f_open))
+        # File type, Object class and the empty line
+        values.read_line(), values.read_line(), values.read_line()
+        values.read_float(), values.read_float()  # xmin and xmax
+        short = values.read_line().strip() == "<exists>"
+        tier_num = values.read_int()
+        if not short:
+            values.read_line()  # item []:
+        for _ in range(tier_num):
+            if tiers.keys() == tier_names:
+                break
+            if not short:
+                values.read_line()  # item [i]:
+            tier_type = values.read_str()
+            name = values.read_str()
+            values.read_float(), values.read_float()  # xmin and xmax
+            keep = name in tier_names and name not in tiers
+            intervals = []
+            for _ in range(values.read_int()):
+                if not short:
+                    values.read_line()  # intervals [i]: or points [i]:
+                start = values.read_float()
+                if tier_type == "IntervalTier":
+                    end = values.read_float()
+                    label = values.read_str()
+                    if keep:
+                        intervals.append((start, end, label))
+                elif tier_type == "TextTier":
+                    label = values.read_str()
+                    if keep:
+                        intervals.append((start, label))
+            if keep:
+                tiers[name] = intervals
+    return tiers
@@ -0,0 +1,324 @@
+import logging
+import os
+import pickle
+import struct
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WAVE_FORMAT_PCM = 1
+
+# numpy dtypes of the samples in PCM wav files, by sample size in bytes
+pcm_dtypes = {1: np.uint8, 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+
+@dataclass
+class wav_header:
+    audio_format: int
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+    data_offset: int
+    data_size: int
+
+    @property
+    def frame_width(self) -> int:
+        return self.channels * (self.bits_per_sample // 8)
+
+    @property
+    def n_frames(self) -> int:
+        return self.data_size // self.frame_width
+
+    @property
+    def duration(self) -> float:
+        # returns: duration in seconds
+        return self.n_frames / self.sample_rate
+
+    def is_pcm(self, sample_rate=None, bits_per_sample=None) -> bool:
+        """True if the file holds plain PCM data, optionally at the given sample rate and sample size"""
+        return (
+            self.audio_format == WAVE_FORMAT_PCM
+            and (sample_rate is None or self.sample_rate == sample_rate)
+            and (bits_per_sample is None or self.bits_per_sample == bits_per_sample)
+        )
+
+
+def read_wav_header(filename):
+    """Read the RIFF header of a .wav file without reading the audio data.
+    The chunks are walked the same way as pydub does: at most 10 subchunks,
+    and the data chunk is the last one. The size of the data chunk is capped by
+    the actual size of the file, so truncated files give the available data."""
+    with open(filename, "rb") as f_open:
+        file_size = os.fstat(f_open.fileno()).st_size
+        riff = f_open.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ValueError("{} is not a RIFF/WAVE file".format(filename))
+        fmt = None
+        pos = 12
+        n_subchunks = 0
+        while pos + 8 <= file_size and n_subchunks < 10:
+            f_open.seek(pos)
+            subchunk_id, subchunk_size = struct.unpack("<4sI", f_open.read(8))
+            n_subchunks += 1
+            if subchunk_id == b"fmt " and fmt is None:
+                if subchunk_size < 16:
+                    break
+                fmt = struct.unpack("<HHIIHH", f_open.read(16))
+            if subchunk_id == b"data":
+                if fmt is None:
+                    break
+                audio_format, channels, sample_rate, _, _, bits_per_sample = fmt
+                return wav_header(
+                    audio_format,
+                    channels,
+                    sample_rate,
+                    bits_per_sample,
+                    pos + 8,
+                    min(subchunk_size, file_size - pos - 8),
+                )
+            pos += subchunk_size + 8
+    raise ValueError("Couldn't find fmt and data headers in {}".format(filename))
+
+
+def get_wav_duration(filename):
+    # returns: duration in seconds, reading only the header of the file
+    return read_wav_header(filename).duration
+
+
+class wav_duration_prober:
+    """Durations of wav files read from their headers only, probed in a pool of threads
+    (reading headers is bound by I/O, not by the GIL). With a cache_file, the durations are
+    stored in a pickle keyed by the absolute path, size and modification time of each audio
+    file, so that later runs only stat the files. The same cache file can be shared by any
+    parser. Use it as a context manager, or call save(), to write the cache:
+
+        with wav_duration_prober(cache_file) as prober:
+            durations = prober.durations(wav_files)  # None for missing files
+    """
+
+    def __init__(self, cache_file=None, workers=8):
+        self.cache_file = cache_file
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        # absolute path -> (size, mtime_ns, duration)
+        self._durations = {}
+        self._modified = False
+        if cache_file is not None:
+            self._load()
+        self._executor = None
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "rb") as f_open:
+                durations = pickle.load(f_open)
+            if not isinstance(durations, dict):
+                raise TypeError("not a dict of durations")
+            self._durations = durations
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # e.g. a truncated or stale pickle: the durations are read from the headers
+            # again and the cache is overwritten on save
+            logger.debug(
+                "Wav duration cache: could not load {}, starting from an empty cache ({!r})".format(
+                    self.cache_file, e
+                )
+            )
+
+    def _probe(self, path):
+        # returns (duration, cache hit), duration is None for missing files
+        abs_path = os.path.abspath(path)
+        try:
+            stat = os.stat(abs_path)
+        except FileNotFoundError:
+            return None, False
+        cached = self._durations.get(abs_path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2], True
+        duration = get_wav_duration(abs_path)
+        self._durations[abs_path] = (stat.st_size, stat.st_mtime_ns, duration)
+        self._modified = True
+        return duration, False
+
+    def durations(self, paths):
+        """Returns the durations in seconds of the wav files in paths, in the same order,
+        with None for the files that don't exist"""
+        if self.workers > 1 and len(paths) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            results = list(self._executor.map(self._probe, paths))
+        else:
+            results = [self._probe(path) for path in paths]
+        for duration, hit in results:
+            if duration is not None:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return [duration for duration, _ in results]
+
+    def duration(self, path):
+        """Duration in seconds of a wav file, raises FileNotFoundError if it doesn't exist"""
+        duration = self.durations([path])[0]
+        if duration is None:
+            raise FileNotFoundError(path)
+        return duration
+
+    def save(self):
+        if self.cache_file is None or not self._modified:
+            return
+        # written to a temporary file first, so that an interrupted run keeps the old cache
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.cache_file)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f_open:
+                pickle.dump(self._durations, f_open, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+        os.replace(tmp_filename, self.cache_file)
+        self._modified = False
+
+    def close(self):
+        self.save()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.cache_file is not None:
+            logger.info(
+                "Wav duration cache: {} durations loaded from the cache, {} read from headers".format(
+                    self.hits, self.misses
+                )
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Columns of the standardized csvs, which are written without a header row: the fields of
+# a consolidated_utterance followed by the standardized text
+standardized_csv_columns = [
+    "speaker_id",
+    "gender",
+    "utterance_id",
+    "language",
+    "raw_text",
+    "full_audio_file",
+    "original_data_split",
+    "region",
+    "duration",
+    "start",
+    "end",
+    "utterance_audio_file",
+    "standardized_text",
+]
+
+
+def _utterance_field(utterance, names, column):
+    """Get the first of the given fields from a consolidated_utterance, a dict or a pandas row,
+    or else the given column of standardized_csv_columns from a row read without a header
+    (a list or tuple from csv.reader, or a pandas row read with header=None)"""
+    for name in names + [column, standardized_csv_columns.index(column)]:
+        if isinstance(name, str):
+            try:
+                return getattr(utterance, name)
+            except AttributeError:
+                pass
+        try:
+            return utterance[name]
+        except (KeyError, IndexError, TypeError):
+            pass
+    raise KeyError("Utterance has none of the fields {}".format(names + [column]))
+
+
+class segment_reader:
+    """Reads the audio of utterances straight from the full audio files, using the
+    start and end times of the utterance, so that no segment files need to be written.
+    The full audio files must be PCM wav files. Open files and their headers are kept
+    in an LRU cache of at most max_open_files entries. The samples are at the sample rate
+    of the full audio file, they are only the same as the ones in the segment files written by
+    standardize.utils.export_audio_segments for 16 kHz files, as the export resamples to 16 kHz."""
+
+    def __init__(self, path_to_data="", max_open_files=64):
+        self.path_to_data = path_to_data
+        self.max_open_files = max_open_files
+        # path -> (open file, wav_header), least recently used first
+        self._open_files = OrderedDict()
+
+    def _open(self, path):
+        if path in self._open_files:
+            self._open_files.move_to_end(path)
+            return self._open_files[path]
+        header = read_wav_header(path)
+        if not header.is_pcm() or header.bits_per_sample // 8 not in pcm_dtypes:
+            raise ValueError(
+                "{} is not a 8, 16 or 32 bit PCM wav file and can't be read as segments".format(
+                    path
+                )
+            )
+        self._open_files[path] = (open(path, "rb"), header)
+        while len(self._open_files) > self.max_open_files:
+            _, (f_open, _) = self._open_files.popitem(last=False)
+            f_open.close()
+        return self._open_files[path]
+
+    def read_file(self, audio_file, start_time=0, end_time=None):
+        """Returns the samples between start_time and end_time (in seconds) of audio_file
+        as a numpy array, of shape (frames,) for mono files and (frames, channels) otherwise.
+        end_time=None reads until the end of the file."""
+        f_open, header = self._open(os.path.join(self.path_to_data, audio_file))
+        # milliseconds are converted to frames the same way as in the segment export
+        frames_per_ms = header.sample_rate / 1000.0
+        length_ms = round(1000 * header.duration)
+        start_frame = int(min(round(start_time * 1000), length_ms) * frames_per_ms)
+        if end_time is None:
+            end_frame = header.n_frames
+        else:
+            end_frame = int(min(round(end_time * 1000), length_ms) * frames_per_ms)
+        end_frame = max(start_frame, end_frame)
+        data = os.pread(
+            f_open.fileno(),
+            (max(start_frame, min(end_frame, header.n_frames)) - start_frame)
+            * header.frame_width,
+            header.data_offset + start_frame * header.frame_width,
+        )
+        # rounding to milliseconds can ask for a few frames more than the file has,
+        # these are padded with silence as in the segment export
+        missing_frames = end_frame - start_frame - len(data) // header.frame_width
+        if missing_frames > 0 and data:
+            data += bytes(header.frame_width * missing_frames)
+        samples = np.frombuffer(data, dtype=pcm_dtypes[header.bits_per_sample // 8])
+        if header.channels > 1:
+            samples = samples.reshape(-1, header.channels)
+        return samples
+
+    def read(self, utterance):
+        """Returns the samples of an utterance, given as a consolidated_utterance or a row of
+        a standardized csv: a dict or pandas row with either the consolidated_utterance field
+        names or the standardized_csv_columns names, or a row read without a header, as the
+        csvs are written (a list from csv.reader, or a pandas row read with header=None)"""
+        return self.read_file(
+            _utterance_field(utterance, ["audio_file"], "full_audio_file"),
+            float(_utterance_field(utterance, ["start_time"], "start")),
+            float(_utterance_field(utterance, ["end_time"], "end")),
+        )
+
+    def close(self):
+        for f_open, _ in self._open_files.values():
+            f_open.close()
+        self._open_files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
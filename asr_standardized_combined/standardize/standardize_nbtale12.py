@@ -1,5 +1,4 @@
 import os
-import re
 
 import random  # to show a few random transcripts
 import datetime  # to store date of creation in config file
@@ -21,7 +20,9 @@ import logging
 from .utils import (
     out_of_alphabet,
     substitute_underscores,
-    replace_symbols,
+    compiled_substitutions,
+    remove_extra_spaces,
+    sentence_pipeline,
     remove_empty_utt,
     play_audios,
 )
@@ -38,6 +39,9 @@ default_keep_symbols = True
 default_keep_numerals = True
 default_keep_empty = True
 default_verbose = False
+default_workers = 1
+default_chunksize = None
+default_cache_size = 100000
 
 # Parser
 parser = argparse.ArgumentParser(
@@ -102,6 +106,34 @@ parser.add_argument(
     action="store_true",
     help="Opens audio files in VSCode whose transcriptions contain tokens out of alphabet after standardization",
 )
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=default_workers,
+    help="Number of processes used to standardize the transcriptions",
+)
+parser.add_argument(
+    "-cs",
+    "--chunksize",
+    type=int,
+    default=default_chunksize,
+    help="Number of transcriptions sent to a process at a time when using several workers",
+)
+parser.add_argument(
+    "-cache",
+    "--cache_size",
+    type=int,
+    default=default_cache_size,
+    help="Maximum number of distinct transcriptions whose standardization is cached and reused for repeated transcriptions (0 disables the cache)",
+)
+parser.add_argument(
+    "-pc",
+    "--parse_cache_dir",
+    type=str,
+    default=None,
+    help="Directory where the parsed corpus files are cached, so that only new or modified files are parsed in later runs",
+)
 parser.add_argument(
     "-v",
     "--verbose",
@@ -188,6 +220,9 @@ def standardize(
     keep_numerals=default_keep_numerals,
     keep_empty=default_keep_empty,
     verbose=default_verbose,
+    workers=default_workers,
+    chunksize=default_chunksize,
+    cache_size=default_cache_size,
 ):
 
     """
@@ -201,6 +236,13 @@ def standardize(
         Determines whether we want to replace tokens according to wordDic_num
     verbose: bool
         Outputs extra information about the standardization process (default is False)
+    workers: int
+        Number of processes used to standardize the transcriptions (default is 1, i.e. no multiprocessing)
+    chunksize: int
+        Number of transcriptions sent to a process at a time (default is None, i.e. 4 chunks per process)
+    cache_size: int
+        Maximum number of distinct transcriptions whose standardization is kept in an LRU cache and
+        reused for repeated transcriptions, per process (default is 100000, 0 disables the cache)
 
     Returns
     -------
@@ -211,42 +253,37 @@ def standardize(
     if verbose:
         logger.setLevel(logging.DEBUG)
 
+    # All the stages below are fused into one function applied to each sentence
+    pipeline = sentence_pipeline()
+
     # Lower case and substitutions needed to be able to parse the transcriptions
-    standardized_transcripts = [s.lower() for s in transcription_list]
+    pipeline.add(str.lower)
 
     # Numerals
     if not keep_numerals:
-        standardized_transcripts = [
-            replace_symbols(s, wordDic_num) for s in standardized_transcripts
-        ]
+        pipeline.add(compiled_substitutions(wordDic_num))
 
     # Events without an associated sound but that modify the speech form
     if not keep_nv_annotations:
-        standardized_transcripts = [
-            replace_symbols(s, wordDic_annot) for s in standardized_transcripts
-        ]
+        pipeline.add(compiled_substitutions(wordDic_annot))
 
     # Events that could in principle have a transcription (not provided)
     if not keep_v_annotations:
-        standardized_transcripts = [
-            replace_symbols(s, wordDic_sounds) for s in standardized_transcripts
-        ]
+        pipeline.add(compiled_substitutions(wordDic_sounds))
 
     # Special characters and abbreviations
     if not keep_symbols:
-        standardized_transcripts = [
-            replace_symbols(s, wordDic_sym) for s in standardized_transcripts
-        ]
+        pipeline.add(compiled_substitutions(wordDic_sym))
 
     # Underscores (important: after normalizations)
-    standardized_transcripts = [
-        substitute_underscores(sentence) if "_" in sentence else sentence
-        for sentence in standardized_transcripts
-    ]
+    pipeline.add(substitute_underscores, when="_")
 
     # Remove useless spaces
-    standardized_transcripts = [re.sub(" +", " ", s) for s in standardized_transcripts]
-    standardized_transcripts = [s.strip() for s in standardized_transcripts]
+    pipeline.add(remove_extra_spaces)
+
+    standardized_transcripts = pipeline.map(
+        transcription_list, workers=workers, chunksize=chunksize, cache_size=cache_size
+    )
 
     if not keep_empty:
         # Remove empty utterances
@@ -338,7 +375,7 @@ def save_csv(args, df, data_dir, filename):
         config_dict = {
             k: v
             for k, v in config_dict.items()
-            if k not in ["listen", "save_filename", "verbose"]
+            if k not in ["listen", "save_filename", "verbose", "workers", "chunksize", "cache_size", "parse_cache_dir"]
         }
         logger.info("Saving config to {}.json".format(stamped_path_to_filename))
         with open("{}.json".format(stamped_path_to_filename), "w") as fp:
@@ -376,7 +413,7 @@ if __name__ == "__main__":
     )
 
     # Getting data - only free speech
-    output = parse_nbtale(args.data_dir)
+    output = parse_nbtale(args.data_dir, cache_dir=args.parse_cache_dir)
     audio_list, trans_list = zip(
         *[
             (o.audio_file, o.sentence_text_raw)
@@ -401,6 +438,9 @@ if __name__ == "__main__":
         keep_empty=args.keep_empty,
         segmented_audio_list=segmented_audio_list,
         verbose=args.verbose,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        cache_size=args.cache_size,
     )
 
     # Get the right dataframe
@@ -428,6 +468,11 @@ if __name__ == "__main__":
                 len(out_of_alphabet_info[2])
             )
         )
+        logger.debug(
+            "Occurrences of each character out of alphabet: {}".format(
+                dict(out_of_alphabet_info.letter_counts.most_common())
+            )
+        )
     if len(out_of_alphabet_info[1]) > 1:
         logger.warning(
             "You have transcriptions with several tokens outside the alphabet you defined -- reconsider your (life) choices"
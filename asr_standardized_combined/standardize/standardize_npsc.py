@@ -8,7 +8,6 @@ import csv  # to store csv
 import json  # to create config file
 import os
 import random  # to show a few random transcripts
-import re
 from subprocess import call  # for opening audios in VSCode
 
 import argparse
@@ -18,7 +17,9 @@ import logging
 from .utils import (
     out_of_alphabet,
     substitute_underscores,
-    replace_symbols,
+    compiled_substitutions,
+    remove_extra_spaces,
+    sentence_pipeline,
     play_audios,
     substitute_hesitations,
 )
@@ -40,6 +41,9 @@ default_keep_symbols = True
 default_keep_numerals = True
 default_keep_empty = True
 default_verbose = False
+default_workers = 1
+default_chunksize = None
+default_cache_size = 100000
 default_patch = True
 
 # Parser
@@ -119,6 +123,34 @@ parser.add_argument(
     action="store_true",
     help="Opens audio files in VSCode whose transcriptions contain tokens out of alphabet after standardization",
 )
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=default_workers,
+    help="Number of processes used to parse the sessions and to standardize the transcriptions",
+)
+parser.add_argument(
+    "-cs",
+    "--chunksize",
+    type=int,
+    default=default_chunksize,
+    help="Number of transcriptions sent to a process at a time when using several workers",
+)
+parser.add_argument(
+    "-cache",
+    "--cache_size",
+    type=int,
+    default=default_cache_size,
+    help="Maximum number of distinct transcriptions whose standardization is cached and reused for repeated transcriptions (0 disables the cache)",
+)
+parser.add_argument(
+    "-pc",
+    "--parse_cache_dir",
+    type=str,
+    default=None,
+    help="Directory where the parsed corpus files are cached, so that only new or modified files are parsed in later runs",
+)
 parser.add_argument(
     "-v",
     "--verbose",
@@ -250,20 +282,71 @@ def substitute_piped_words(sentence, standard_words):
         Sentence where the (non-)standard version of the words is chosen
     """
     tokenized_sentence = sentence.split()
-    standardized_tokens = []
-    for word in tokenized_sentence:
-        if "|" in word:
-            if "|1" in word:
-                replaced_word = word.split("|")[0]
+    standardized_tokens = [
+        choose_piped_word(word, standard_words) for word in tokenized_sentence
+    ]
+    return " ".join(standardized_tokens)
+
+
+def choose_piped_word(word, standard_words):
+    """
+    Chooses the non-standard or the standardized version of a word of a sentence,
+    where non-standard|standardized and non-standard|1 pairs are piped.
+    Words with "|1" keep the non-standard version.
+    """
+    if "|" in word:
+        if "|1" in word:
+            replaced_word = word.split("|")[0]
+        else:
+            if standard_words:
+                replaced_word = word.split("|")[1]
             else:
-                if standard_words:
-                    replaced_word = word.split("|")[1]
-                else:
-                    replaced_word = word.split("|")[0]
+                replaced_word = word.split("|")[0]
+    else:
+        replaced_word = word
+    return replaced_word
+
+
+def select_token_variants(tokens, standard_words):
+    """
+    Builds a sentence from the structured NPSC tokens (see parsers.npsc_parser.create_tokens),
+    giving exactly the same sentence as substitute_piped_words on the token_text|standardized_form
+    (or token_text|1) encoding built by parsers.npsc_parser.create_sentence. This includes
+    keeping the token text when the encoded word contains "|1" (so also for standardized forms
+    starting with "1") and splitting standardized forms on whitespace. As in standardize, only
+    sentences with a "|" go through substitute_piped_words, so when no token is piped the token
+    texts are joined as they are, keeping their tabs and repeated whitespace.
+
+    Parameters
+    ----------
+    tokens: sequence of (token_text, standardized_form, phon_ort_discrepancy) tuples
+    standard_words: bool
+        Determines whether we want to choose the (non-)standard version
+        (default is True, i.e. we use the standardized version)
+
+    Returns
+    -------
+    sentence: str
+        Sentence where the (non-)standard version of the words is chosen
+    """
+    if not any(
+        standardized_form or phon_ort_discrepancy or "|" in token_text
+        for token_text, standardized_form, phon_ort_discrepancy in tokens
+    ):
+        return " ".join(token_text for token_text, _, _ in tokens)
+    words = []
+    for token_text, standardized_form, phon_ort_discrepancy in tokens:
+        if standardized_form:
+            piped_word = "{}|{}".format(token_text, standardized_form)
+        elif phon_ort_discrepancy:
+            piped_word = "{}|{}".format(token_text, 1)
         else:
-            replaced_word = word
-        standardized_tokens.append(replaced_word)
-    return " ".join(standardized_tokens)
+            piped_word = token_text
+        # the words chosen can be empty, e.g. for " |1990", as in substitute_piped_words
+        words.extend(
+            choose_piped_word(word, standard_words) for word in piped_word.split()
+        )
+    return " ".join(words)
 
 
 def standardize(
@@ -278,6 +361,10 @@ def standardize(
     keep_empty=default_keep_empty,
     verbose=default_verbose,
     patch=default_patch,
+    workers=default_workers,
+    chunksize=default_chunksize,
+    cache_size=default_cache_size,
+    tokens_list=None,
 ):
 
     """
@@ -291,6 +378,17 @@ def standardize(
         Determines whether we want to replace tokens according to wordDic_num
     verbose: bool
         Outputs extra information about the standardization process (default is True)
+    workers: int
+        Number of processes used to standardize the transcriptions (default is 1, i.e. no multiprocessing)
+    chunksize: int
+        Number of transcriptions sent to a process at a time (default is None, i.e. 4 chunks per process)
+    cache_size: int
+        Maximum number of distinct transcriptions whose standardization is kept in an LRU cache and
+        reused for repeated transcriptions, per process (default is 100000, 0 disables the cache)
+    tokens_list: list of token sequences
+        Structured tokens of each transcription, e.g. the tokens of the npsc_utterance objects from
+        parse_npsc(..., structured_tokens=True). If given, the (non-)standard version of each word is
+        picked from the tokens instead of the word|standard strings in transcription_list (default is None)
 
     Returns
     -------
@@ -305,17 +403,46 @@ def standardize(
         transcription_list, alphabet=alphabet
     )
 
-    # Non-standard words
-    standardized_sentences = [
-        substitute_piped_words(sentence, standard_words)
-        if "|" in sentence
-        else sentence
-        for sentence in transcription_list
-    ]
-
     if verbose:
         logger.setLevel(logging.DEBUG)
 
+    # All the stages below are fused into one function applied to each sentence
+    pipeline = sentence_pipeline()
+
+    # Non-standard words
+    if tokens_list is None:
+        sentences = transcription_list
+        pipeline.add(substitute_piped_words, when="|", standard_words=standard_words)
+    else:
+        # picked straight from the structured tokens
+        sentences = [
+            select_token_variants(tokens, standard_words) for tokens in tokens_list
+        ]
+        if verbose:
+            # parity check against the word|standard strings of the transcriptions,
+            # substituted only when they contain a "|", as done without tokens_list
+            mismatches = sum(
+                sentence
+                != (
+                    substitute_piped_words(transcription, standard_words)
+                    if "|" in transcription
+                    else transcription
+                )
+                for sentence, transcription in zip(sentences, transcription_list)
+            )
+            if mismatches:
+                logger.warning(
+                    "{} of {} sentences picked from the tokens differ from their transcription".format(
+                        mismatches, len(sentences)
+                    )
+                )
+            else:
+                logger.debug(
+                    "All {} sentences picked from the tokens match their transcription".format(
+                        len(sentences)
+                    )
+                )
+
     nonstandard_piped_sentences = [
         sentence for sentence in del_sentences if "|" in sentence
     ]
@@ -335,44 +462,46 @@ def standardize(
         )  # checks
 
     # Underscores
-    underscored_sentences_after = [
-        sentence for sentence in standardized_sentences if "_" in sentence
-    ]
-    logger.debug("")
-    logger.debug("***REMOVING UNDERSCORES***")
-    logger.debug(
-        "Number of unique sentences with underscored words: {}".format(
-            len(underscored_sentences_after)
+    if logger.isEnabledFor(logging.DEBUG):
+        # extra pass over the data only needed for the counts
+        underscored_sentences_after = [
+            sentence for sentence in sentences if "_" in pipeline(sentence)
+        ]
+        logger.debug("")
+        logger.debug("***REMOVING UNDERSCORES***")
+        logger.debug(
+            "Number of unique sentences with underscored words: {}".format(
+                len(underscored_sentences_after)
+            )
         )
-    )
 
-    standardized_sentences = [
-        substitute_underscores(sentence) if "_" in sentence else sentence
-        for sentence in standardized_sentences
-    ]
+    pipeline.add(substitute_underscores, when="_")
 
     # Lower case
     # TODO: adapt to lower_case=False (requires expanding wordDic_sym and wordDic_num among other things)
     # if lower_case:
-    standardized_sentences = [s.lower() for s in standardized_sentences]
+    pipeline.add(str.lower)
 
     # Non-verbal annotations
-    hesitation_sentences = [
-        sentence for sentence in standardized_sentences if annotation_token in sentence
-    ]
     hesitation_words = [
         word
         for sentence in del_sentences
         for word in sentence.lower().split()
         if annotation_token in word
     ]
-    logger.debug("")
-    logger.debug("***NON-VERBAL ANNOTATIONS***")
-    logger.debug(
-        "Number of unique sentences with annotations: {}".format(
-            len(hesitation_sentences)
+    if logger.isEnabledFor(logging.DEBUG):
+        hesitation_sentences = [
+            sentence
+            for sentence in sentences
+            if annotation_token in pipeline(sentence)
+        ]
+        logger.debug("")
+        logger.debug("***NON-VERBAL ANNOTATIONS***")
+        logger.debug(
+            "Number of unique sentences with annotations: {}".format(
+                len(hesitation_sentences)
+            )
         )
-    )
     if substitution_token:
         logger.debug(
             'Different annotations found in the data substituted by "{}": {}'.format(
@@ -393,42 +522,35 @@ def standardize(
                 )
             )
 
-    standardized_sentences = [
-        substitute_hesitations(
-            sentence,
-            keep_annotations,
-            annotation_token,
-            substitution_token,
-            wordDic_hes,
-        )
-        if annotation_token in sentence
-        else sentence
-        for sentence in standardized_sentences
-    ]
+    pipeline.add(
+        substitute_hesitations,
+        when=annotation_token,
+        keep_annotations=keep_annotations,
+        annotation_token=annotation_token,
+        substitution_token=substitution_token,
+        wordDic_hes=compiled_substitutions(wordDic_hes),
+    )
 
     # Patch
     if patch:
         logger.info("Applying patch dated {}".format(date_patch))
-        standardized_sentences = [
-            replace_symbols(s, patch_dict) for s in standardized_sentences
-        ]
+        pipeline.add(compiled_substitutions(patch_dict))
     else: logger.info("NOT applying patch")
         
     # Symbols
     if not keep_symbols:
-        standardized_sentences = [
-            replace_symbols(s, wordDic_sym) for s in standardized_sentences
-        ]
+        pipeline.add(compiled_substitutions(wordDic_sym))
 
     # Numerals
     if not keep_numerals:
-        standardized_sentences = [
-            replace_symbols(s, wordDic_num) for s in standardized_sentences
-        ]
+        pipeline.add(compiled_substitutions(wordDic_num))
 
     # Remove useless spaces
-    standardized_sentences = [re.sub(" +", " ", s) for s in standardized_sentences]
-    standardized_sentences = [s.strip() for s in standardized_sentences]
+    pipeline.add(remove_extra_spaces)
+
+    standardized_sentences = pipeline.map(
+        sentences, workers=workers, chunksize=chunksize, cache_size=cache_size
+    )
 
     # Remove empty utterances or those containing just a non-verbal annotation
     standardized_audios = audio_list
@@ -572,7 +694,7 @@ def save_csv(
         config_dict = {
             k: v
             for k, v in config_dict.items()
-            if k not in ["listen", "save_filename", "verbose"]
+            if k not in ["listen", "save_filename", "verbose", "workers", "chunksize", "cache_size", "parse_cache_dir"]
         }
         logger.info("Saving config to {}.json".format(stamped_path_to_filename))
         with open("{}.json".format(stamped_path_to_filename), "w") as fp:
@@ -609,19 +731,24 @@ if __name__ == "__main__":
     )
 
     # Getting data
-    output = parse_npsc(args.data_dir)
+    output = parse_npsc(
+        args.data_dir,
+        workers=args.workers,
+        cache_dir=args.parse_cache_dir,
+        structured_tokens=True,
+    )
     if args.language == "both":
-        audio_list, trans_list = zip(
+        audio_list, trans_list, tokens_list = zip(
             *[
-                (o.segmented_audio_file, o.sentence_text_raw)
+                (o.segmented_audio_file, o.sentence_text_raw, o.tokens)
                 for o in output
                 if o.sentence_language_code != "en-US"
             ]
         )
     else:
-        audio_list, trans_list = zip(
+        audio_list, trans_list, tokens_list = zip(
             *[
-                (o.segmented_audio_file, o.sentence_text_raw)
+                (o.segmented_audio_file, o.sentence_text_raw, o.tokens)
                 for o in output
                 if o.sentence_language_code == args.language
             ]
@@ -639,6 +766,10 @@ if __name__ == "__main__":
         keep_empty=args.keep_empty,
         audio_list=audio_list,
         verbose=args.verbose,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        cache_size=args.cache_size,
+        tokens_list=tokens_list,
     )
 
     # Debugging and listening
@@ -657,6 +788,11 @@ if __name__ == "__main__":
                 len(out_of_alphabet_info[2])
             )
         )
+        logger.debug(
+            "Occurrences of each character out of alphabet: {}".format(
+                dict(out_of_alphabet_info.letter_counts.most_common())
+            )
+        )
     if len(out_of_alphabet_info[1]) > 1:
         logger.warning(
             "You have transcriptions with several tokens outside the alphabet you defined -- reconsider your (life) choices"
@@ -1,9 +1,9 @@
 import os
-import re
 from subprocess import call  # for opening audios in VSCode
 import random  # to show a few random transcripts
 import datetime  # to store date of creation in config file
 import json
+from collections import Counter
 from tabnanny import verbose  # to create config file
 import pandas as pd
 
@@ -22,7 +22,11 @@ import logging
 from .utils import (
     out_of_alphabet,
     substitute_underscores,
-    replace_symbols,
+    compiled_substitutions,
+    remove_extra_spaces,
+    pipeline_mapper,
+    sentence_pipeline,
+    iter_batches,
     remove_empty_utt,
     play_audios,
 )
@@ -32,12 +36,17 @@ import sys
 from .patch_nst import patch_dict, date_patch
 
 sys.path.append("..")  # for importing from other dir
-from ..parsers.nst_parser import parse_nst
+from ..parsers.nst_parser import iter_nst
 
 # set defaults here for parameters so we can use them between both the argparse and the standardize()
 default_keep_symbols = True
 default_keep_numerals = True
 default_verbose = False
+default_workers = 1
+default_chunksize = None
+default_cache_size = 100000
+default_batch_size = 100000
+default_dedup_keys = ["audio_path"]
 default_patch = True
 
 # Parser
@@ -78,6 +87,49 @@ parser.add_argument(
     action="store_true",
     help="Opens audio files in VSCode whose transcriptions contain tokens out of alphabet after standardization",
 )
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=default_workers,
+    help="Number of processes used to standardize the transcriptions",
+)
+parser.add_argument(
+    "-cs",
+    "--chunksize",
+    type=int,
+    default=default_chunksize,
+    help="Number of transcriptions sent to a process at a time when using several workers",
+)
+parser.add_argument(
+    "-cache",
+    "--cache_size",
+    type=int,
+    default=default_cache_size,
+    help="Maximum number of distinct transcriptions whose standardization is cached and reused for repeated transcriptions (0 disables the cache)",
+)
+parser.add_argument(
+    "-pc",
+    "--parse_cache_dir",
+    type=str,
+    default=None,
+    help="Directory where the parsed corpus files are cached, so that only new or modified files are parsed in later runs",
+)
+parser.add_argument(
+    "-bs",
+    "--batch_size",
+    type=int,
+    default=default_batch_size,
+    help="Number of utterances parsed, standardized and saved at a time, which bounds the memory used",
+)
+parser.add_argument(
+    "-dk",
+    "--dedup_keys",
+    nargs="+",
+    choices=["audio_path", "speaker_text"],
+    default=default_dedup_keys,
+    help="Keys on which test utterances duplicating a train utterance are removed: the audio path relative to the audio folder and/or the speaker and prompt text",
+)
 parser.add_argument(
     "-v",
     "--verbose",
@@ -128,12 +180,58 @@ wordDic_num = {
 }
 
 
+def standardize_pipeline(
+    keep_symbols=default_keep_symbols,
+    keep_numerals=default_keep_numerals,
+    patch=default_patch,
+):
+    """
+    Builds the sentence_pipeline of the NST standardization, all the stages fused into one function
+    applied to each sentence. See standardize for the parameters.
+
+    Returns
+    -------
+    pipeline: sentence_pipeline
+    """
+
+    pipeline = sentence_pipeline()
+
+    # Lower case and substitutions needed to be able to parse the transcriptions
+    pipeline.add(str.lower)
+
+    # Patch
+    if patch:
+        logger.info("Applying patch dated {}".format(date_patch))
+        pipeline.add(compiled_substitutions(patch_dict))
+    else: logger.info("NOT applying patch")
+        
+    # Numerals
+    if not keep_numerals:
+        pipeline.add(compiled_substitutions(wordDic_num))
+
+    # Special characters and abbreviations
+    if not keep_symbols:
+        pipeline.add(compiled_substitutions(wordDic_sym))
+
+    # Underscores (important: after normalizations)
+    pipeline.add(substitute_underscores, when="_")
+
+    # Remove useless spaces
+    pipeline.add(remove_extra_spaces)
+
+    return pipeline
+
+
 def standardize(
     transcription_list,
     keep_symbols=default_keep_symbols,
     keep_numerals=default_keep_numerals,
     verbose=default_verbose,
     patch=default_patch,
+    workers=default_workers,
+    chunksize=default_chunksize,
+    cache_size=default_cache_size,
+    mapper=None,
 ):
 
     """
@@ -147,6 +245,17 @@ def standardize(
         Determines whether we want to replace tokens according to wordDic_num
     verbose: bool
         Outputs extra information about the standardization process (default is False)
+    workers: int
+        Number of processes used to standardize the transcriptions (default is 1, i.e. no multiprocessing)
+    chunksize: int
+        Number of transcriptions sent to a process at a time (default is None, i.e. 4 chunks per process)
+    cache_size: int
+        Maximum number of distinct transcriptions whose standardization is kept in an LRU cache and
+        reused for repeated transcriptions, per process (default is 100000, 0 disables the cache)
+    mapper: pipeline_mapper
+        Mapper of a standardize_pipeline used instead of building a new pipeline, so that its cache and
+        worker processes are reused across batches of transcriptions. keep_symbols, keep_numerals, patch,
+        workers, chunksize and cache_size are then those the mapper was built with (default is None)
 
     Returns
     -------
@@ -157,38 +266,14 @@ def standardize(
     if verbose:
         logger.setLevel(logging.DEBUG)
 
-    # Lower case and substitutions needed to be able to parse the transcriptions
-    standardized_transcripts = [s.lower() for s in transcription_list]
-
-    # Patch
-    if patch:
-        logger.info("Applying patch dated {}".format(date_patch))
-        standardized_transcripts = [
-            replace_symbols(s, patch_dict) for s in standardized_transcripts
-        ]
-    else: logger.info("NOT applying patch")
-        
-    # Numerals
-    if not keep_numerals:
-        standardized_transcripts = [
-            replace_symbols(s, wordDic_num) for s in standardized_transcripts
-        ]
-
-    # Special characters and abbreviations
-    if not keep_symbols:
-        standardized_transcripts = [
-            replace_symbols(s, wordDic_sym) for s in standardized_transcripts
-        ]
-
-    # Underscores (important: after normalizations)
-    standardized_transcripts = [
-        substitute_underscores(sentence) if "_" in sentence else sentence
-        for sentence in standardized_transcripts
-    ]
-
-    # Remove useless spaces
-    standardized_transcripts = [re.sub(" +", " ", s) for s in standardized_transcripts]
-    standardized_transcripts = [s.strip() for s in standardized_transcripts]
+    if mapper is None:
+        standardized_transcripts = standardize_pipeline(
+            keep_symbols=keep_symbols, keep_numerals=keep_numerals, patch=patch
+        ).map(
+            transcription_list, workers=workers, chunksize=chunksize, cache_size=cache_size
+        )
+    else:
+        standardized_transcripts = mapper.map(transcription_list)
 
     # Show a few random transcripts
     if verbose:
@@ -200,6 +285,62 @@ def standardize(
     return standardized_transcripts
 
 
+def csv_save_path(data_dir, filename):
+    """
+    Returns the path (without extension) of the csv and json files saved by save_csv,
+    "data_dir/standardized_csvs/filename_date", with a number appended so that no file is overwritten.
+    Returns None if filename is None.
+    """
+    if filename is None:
+        return None
+    stamp = datetime.datetime.now().strftime("%Y%m%d")
+    logger.info("")
+    path_to_file = os.path.join(data_dir, "standardized_csvs")
+    path_to_filename = os.path.join(path_to_file, filename)
+    stamped_path_to_filename = "{}_{}".format(path_to_filename, stamp)
+    if not os.path.exists(path_to_file):
+        os.mkdir(path_to_file)
+
+    # Don't overwrite - the choices below are rather arbitrary
+    if os.path.exists("{}.csv".format(stamped_path_to_filename)):
+        for n in range(1, 100):
+            stamped_path_to_filename = "{}_{}".format(path_to_filename, stamp)
+            if os.path.exists("{}_{}.csv".format(stamped_path_to_filename, n)):
+                logger.info(
+                    "File already exists, saving as {}_{}.csv instead".format(
+                        stamped_path_to_filename, n + 1
+                    )
+                )
+                stamped_path_to_filename = "{}_{}".format(
+                    stamped_path_to_filename, n + 1
+                )
+            else:
+                stamped_path_to_filename = "{}_{}".format(
+                    stamped_path_to_filename, n
+                )
+                break
+    return stamped_path_to_filename
+
+
+def save_config(args, stamped_path_to_filename):
+    """
+    Saves the standardization options chosen and the date in "stamped_path_to_filename.json".
+    """
+    stamp = datetime.datetime.now().strftime("%Y%m%d")
+    # TODO: Warn when properties in json file coincide (other than csv_creation_date)
+    # Dump to json
+    config_dict = vars(args)
+    config_dict["csv_creation_date"] = stamp
+    config_dict = {
+        k: v
+        for k, v in config_dict.items()
+        if k not in ["listen", "save_filename", "verbose", "workers", "chunksize", "cache_size", "batch_size", "parse_cache_dir"]
+    }
+    logger.info("Saving config to {}.json".format(stamped_path_to_filename))
+    with open("{}.json".format(stamped_path_to_filename), "w") as fp:
+        json.dump(config_dict, fp)
+
+
 def save_csv(args, df, data_dir, filename):
     """
     Saves a csv file with the consolidated utterances and two extra columns with the sentence-segmented audio files'
@@ -224,49 +365,13 @@ def save_csv(args, df, data_dir, filename):
     Nothing, it saves the data in "data_dir/standardized_csvs/filename.csv".
     """
     if filename is not None:
-        stamp = datetime.datetime.now().strftime("%Y%m%d")
-        logger.info("")
-        path_to_file = os.path.join(data_dir, "standardized_csvs")
-        path_to_filename = os.path.join(path_to_file, filename)
-        stamped_path_to_filename = "{}_{}".format(path_to_filename, stamp)
-        if not os.path.exists(path_to_file):
-            os.mkdir(path_to_file)
-
-        # Don't overwrite - the choices below are rather arbitrary
-        if os.path.exists("{}.csv".format(stamped_path_to_filename)):
-            for n in range(1, 100):
-                stamped_path_to_filename = "{}_{}".format(path_to_filename, stamp)
-                if os.path.exists("{}_{}.csv".format(stamped_path_to_filename, n)):
-                    logger.info(
-                        "File already exists, saving as {}_{}.csv instead".format(
-                            stamped_path_to_filename, n + 1
-                        )
-                    )
-                    stamped_path_to_filename = "{}_{}".format(
-                        stamped_path_to_filename, n + 1
-                    )
-                else:
-                    stamped_path_to_filename = "{}_{}".format(
-                        stamped_path_to_filename, n
-                    )
-                    break
+        stamped_path_to_filename = csv_save_path(data_dir, filename)
 
         logger.info("Saving csv to {}.csv".format(stamped_path_to_filename))
 
         df.to_csv("{}.csv".format(stamped_path_to_filename), header=False, index=False)
 
-        # TODO: Warn when properties in json file coincide (other than csv_creation_date)
-        # Dump to json
-        config_dict = vars(args)
-        config_dict["csv_creation_date"] = stamp
-        config_dict = {
-            k: v
-            for k, v in config_dict.items()
-            if k not in ["listen", "save_filename", "verbose"]
-        }
-        logger.info("Saving config to {}.json".format(stamped_path_to_filename))
-        with open("{}.json".format(stamped_path_to_filename), "w") as fp:
-            json.dump(config_dict, fp)
+        save_config(args, stamped_path_to_filename)
 
 
 if __name__ == "__main__":
@@ -290,57 +395,97 @@ if __name__ == "__main__":
         )
     )
 
-    # Getting data
-    output = parse_nst(args.data_dir, verbose=args.verbose)
-
-    # Put in pandas dataframe and filter to only non "free" speech
-    df = pd.DataFrame([vars(o) for o in output])
-    trans_list = list(df.sentence_text_raw)
+    # Getting, standardizing and saving the data in batches of utterances, so that the
+    # whole corpus is never held in memory
+    stamped_path_to_filename = csv_save_path(args.data_dir, args.save_filename)
+    if stamped_path_to_filename is not None:
+        logger.info("Saving csv to {}.csv".format(stamped_path_to_filename))
+    # words out of alphabet (in order of appearance), their counts and the number of sentences
+    del_words = {}
+    letter_counts = Counter()
+    n_del_sentences = 0
 
-    # Standardizing data
-    standardized_transcripts = standardize(
-        transcription_list=trans_list,
-        keep_symbols=args.keep_symbols,
-        keep_numerals=args.keep_numerals,
+    utterances = iter_nst(
+        args.data_dir,
         verbose=args.verbose,
+        cache_dir=args.parse_cache_dir,
+        dedup_keys=args.dedup_keys,
     )
+    # The pipeline, its cache and its worker processes are shared by all the batches, as the
+    # prompts of NST are repeated across speakers
+    with pipeline_mapper(
+        standardize_pipeline(
+            keep_symbols=args.keep_symbols, keep_numerals=args.keep_numerals
+        ),
+        workers=args.workers,
+        chunksize=args.chunksize,
+        cache_size=args.cache_size,
+    ) as mapper:
+        for i, batch in enumerate(iter_batches(utterances, args.batch_size)):
+            # Put in pandas dataframe
+            df = pd.DataFrame([vars(o) for o in batch])
+            trans_list = list(df.sentence_text_raw)
+
+            # Standardizing data
+            standardized_transcripts = standardize(
+                transcription_list=trans_list,
+                verbose=args.verbose,
+                mapper=mapper,
+            )
 
-    # Get the right dataframe
-    df["standardized_text"] = standardized_transcripts
-
-    # Debugging and listening
-    out_of_alphabet_info = out_of_alphabet(standardized_transcripts, alphabet)
-
-    if out_of_alphabet_info[1] != []:
+            # Get the right dataframe
+            df["standardized_text"] = standardized_transcripts
+
+            # Debugging and listening
+            out_of_alphabet_info = out_of_alphabet(standardized_transcripts, alphabet)
+            del_words.update(dict.fromkeys(out_of_alphabet_info[1]))
+            letter_counts.update(out_of_alphabet_info.letter_counts)
+            n_del_sentences += len(out_of_alphabet_info[2])
+
+            if args.listen and out_of_alphabet_info[1] != []:
+                # Listen to audio files where tokens with characters out of the alphabet appear
+                logger.debug("")
+                logger.debug("***OPENING AUDIO FILES WITH TOKENS OUT OF ALPHABET***")
+                # NOTE we're moving the audio play construction outside of the play_audios() funct
+                # TODO we need to create the audio list with full path(s) here. I dunno what that's supposed to look like
+                play_audios(
+                    standardized_transcripts,
+                    out_of_alphabet_info,
+                    df.segmented_audio_file,
+                    args.data_dir,
+                )
+
+            # Saving data
+            if stamped_path_to_filename is not None:
+                df.to_csv(
+                    "{}.csv".format(stamped_path_to_filename),
+                    header=False,
+                    index=False,
+                    mode="a" if i else "w",
+                )
+
+    if del_words:
         logger.info("")
         logger.warning("***TRANSCRIPTS WITH TOKENS OUT OF ALPHABET***")
         logger.warning(
             "Tokens containing characters out of alphabet at this point: {}".format(
-                out_of_alphabet_info[1]
+                list(del_words)
             )
         )
         logger.warning(
             "Number of sentences with tokens out of alphabet: {}".format(
-                len(out_of_alphabet_info[2])
+                n_del_sentences
+            )
+        )
+        logger.debug(
+            "Occurrences of each character out of alphabet: {}".format(
+                dict(letter_counts.most_common())
             )
         )
-    if len(out_of_alphabet_info[1]) > 1:
+    if len(del_words) > 1:
         logger.warning(
             "You have transcriptions with several tokens outside the alphabet you defined -- reconsider your (life) choices"
         )
 
-    if args.listen and out_of_alphabet_info[1] != []:
-        # Listen to audio files where tokens with characters out of the alphabet appear
-        logger.debug("")
-        logger.debug("***OPENING AUDIO FILES WITH TOKENS OUT OF ALPHABET***")
-        # NOTE we're moving the audio play construction outside of the play_audios() funct
-        # TODO we need to create the audio list with full path(s) here. I dunno what that's supposed to look like
-        play_audios(
-            standardized_transcripts,
-            out_of_alphabet_info,
-            df.segmented_audio_file,
-            args.data_dir,
-        )
-
-    # Saving data
-    save_csv(args, df, args.data_dir, args.save_filename)
+    if stamped_path_to_filename is not None:
+        save_config(args, stamped_path_to_filename)
@@ -7,7 +7,6 @@ from collections import Counter
 import csv  # to store csv
 import json  # to create config file
 import os
-import pandas as pd
 import random  # to show a few random transcripts
 import re
 from subprocess import call  # for opening audios in VSCode
@@ -19,8 +18,10 @@ import logging
 # Project imports
 from .utils import (
     out_of_alphabet,
-    replace_symbols,
-    export_audio_segments,
+    compiled_substitutions,
+    remove_extra_spaces,
+    sentence_pipeline,
+    export_audio_segments_parallel,
     substitute_hesitations,
 )
 import sys
@@ -39,6 +40,9 @@ default_keep_symbols = True
 default_keep_numerals = True
 default_keep_empty = True
 default_verbose = False
+default_workers = 1
+default_chunksize = None
+default_cache_size = 100000
 default_patch = True
 
 
@@ -113,6 +117,34 @@ parser.add_argument(
     action="store_true",
     help="Opens audio files in VSCode whose transcriptions contain tokens out of alphabet after standardization",
 )
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=default_workers,
+    help="Number of processes used to parse the transcription files, to standardize the transcriptions and to export the sentence-segmented audio files",
+)
+parser.add_argument(
+    "-cs",
+    "--chunksize",
+    type=int,
+    default=default_chunksize,
+    help="Number of transcriptions sent to a process at a time when using several workers",
+)
+parser.add_argument(
+    "-cache",
+    "--cache_size",
+    type=int,
+    default=default_cache_size,
+    help="Maximum number of distinct transcriptions whose standardization is cached and reused for repeated transcriptions (0 disables the cache)",
+)
+parser.add_argument(
+    "-pc",
+    "--parse_cache_dir",
+    type=str,
+    default=None,
+    help="Directory where the parsed corpus files are cached, so that only new or modified files are parsed in later runs",
+)
 parser.add_argument(
     "-v",
     "--verbose",
@@ -179,6 +211,8 @@ wordDic_hes = {
 }
 
 annotation_pattern = re.compile("\[.*?\]")
+underscore_pattern_start = re.compile('_(\w)')
+underscore_pattern_end = re.compile('(\w)_')
 
 
 def audio_path(df, path_to_data):
@@ -213,6 +247,28 @@ def audio_path(df, path_to_data):
     return path_segment, path_total
 
 
+def remove_underscore_marks(sentence):
+    """
+    For a sentence, removes the underscores used to mark word forms not allowed by the
+    standard of the speaker, e.g. "_itj", while keeping underscores that stand alone
+    (such as the substitution token).
+    """
+    return underscore_pattern_start.sub(
+        '\g<1>',
+        underscore_pattern_end.sub(
+            '\g<1>',
+            sentence
+        )
+    )
+
+
+def remove_parentheses(sentence):
+    """
+    For a sentence, removes the parentheses used to mark truncated words, e.g. "d()så".
+    """
+    return sentence.replace("()", " ").replace('(', '').replace(')','')
+
+
 def standardize(
     transcription_list,
     keep_annotations=default_keep_annotations,
@@ -222,6 +278,9 @@ def standardize(
     keep_numerals=default_keep_numerals,
     verbose=default_verbose,
     patch=default_patch,
+    workers=default_workers,
+    chunksize=default_chunksize,
+    cache_size=default_cache_size,
 ):
 
     """
@@ -235,6 +294,13 @@ def standardize(
         Determines whether we want to replace tokens according to wordDic_num
     verbose: bool
         Outputs extra information about the standardization process (default is True)
+    workers: int
+        Number of processes used to standardize the transcriptions (default is 1, i.e. no multiprocessing)
+    chunksize: int
+        Number of transcriptions sent to a process at a time (default is None, i.e. 4 chunks per process)
+    cache_size: int
+        Maximum number of distinct transcriptions whose standardization is kept in an LRU cache and
+        reused for repeated transcriptions, per process (default is 100000, 0 disables the cache)
 
     Returns
     -------
@@ -267,68 +333,50 @@ def standardize(
             )
         )
 
+    # All the stages below are fused into one function applied to each sentence
+    pipeline = sentence_pipeline()
+
     # Lower case
-    standardized_sentences = [s.lower() for s in transcription_list]
+    pipeline.add(str.lower)
 
     logger.debug(
         "Sub_token is {} which is a {}".format(
             substitution_token, type(substitution_token)
         )
     )
-    standardized_sentences = [
-        substitute_hesitations(
-            sentence,
-            keep_annotations,
-            annotation_token,
-            substitution_token,
-            wordDic_hes,
-        )
-        if annotation_token in sentence
-        else sentence
-        for sentence in standardized_sentences
-    ]
+    pipeline.add(
+        substitute_hesitations,
+        when=annotation_token,
+        keep_annotations=keep_annotations,
+        annotation_token=annotation_token,
+        substitution_token=substitution_token,
+        wordDic_hes=compiled_substitutions(wordDic_hes),
+    )
 
     # Patch
     if patch:
         logger.info("Applying patch dated {}".format(date_patch))
-        standardized_sentences = [
-            replace_symbols(s, patch_dict) for s in standardized_sentences
-        ]
+        pipeline.add(compiled_substitutions(patch_dict))
     else: logger.info("NOT applying patch")
     
     # Symbols
     if not keep_symbols:
-        standardized_sentences = [
-            replace_symbols(s, wordDic_sym)
-            for s in standardized_sentences
-        ]
-        underscore_pattern_start = re.compile('_(\w)')
-        underscore_pattern_end = re.compile('(\w)_')
-        standardized_sentences = [
-            underscore_pattern_start.sub(
-                '\g<1>',
-                underscore_pattern_end.sub(
-                    '\g<1>',
-                    s
-                )
-            )
-            for s in standardized_sentences  
-        ]
+        pipeline.add(compiled_substitutions(wordDic_sym))
+        pipeline.add(remove_underscore_marks, when="_")
 
     # Numerals
     if not keep_numerals:
-        standardized_sentences = [
-            replace_symbols(s, wordDic_num) for s in standardized_sentences
-        ]
+        pipeline.add(compiled_substitutions(wordDic_num))
 
     # Remove parentheses
-    standardized_sentences = [
-        sentence.replace("()", " ").replace('(', '').replace(')','') for sentence in standardized_sentences
-    ]
+    pipeline.add(remove_parentheses)
 
     # Remove useless spaces
-    standardized_sentences = [re.sub(" +", " ", s) for s in standardized_sentences]
-    standardized_sentences = [s.strip() for s in standardized_sentences]
+    pipeline.add(remove_extra_spaces)
+
+    standardized_sentences = pipeline.map(
+        transcription_list, workers=workers, chunksize=chunksize, cache_size=cache_size
+    )
 
     # Checks
     assert len(transcription_list) == len(
@@ -438,7 +486,7 @@ def save_csv(args, output_df, data_dir, filename):
         config_dict = {
             k: v
             for k, v in config_dict.items()
-            if k not in ["listen", "save_filename", "verbose"]
+            if k not in ["listen", "save_filename", "verbose", "workers", "chunksize", "cache_size", "parse_cache_dir"]
         }
         logger.info("Saving config to {}.json".format(stamped_path_to_filename))
         with open("{}.json".format(stamped_path_to_filename), "w") as fp:
@@ -478,7 +526,12 @@ if __name__ == "__main__":
 
     # Getting data
     transdir = "../data/rundkast"
-    output = pd.DataFrame(parse_rundkast(args.data_dir))
+    output = parse_rundkast(
+        args.data_dir,
+        cache_dir=args.parse_cache_dir,
+        workers=args.workers,
+        as_frame=True,
+    )
     if args.language == "both":
         output = output[output["sentence_language_code"] != "en-US"]
     else:
@@ -493,9 +546,7 @@ if __name__ == "__main__":
     )
     path_to_segment_dir = os.path.join(args.data_dir, "audio_segments")
     logger.info("Sentence-segmented audio files in {}".format(path_to_segment_dir))
-    output.apply(
-        lambda row: export_audio_segments(row, *audio_path(row, args.data_dir)), axis=1
-    )
+    export_audio_segments_parallel(output, args.data_dir, workers=args.workers)
     segmented_audio_list = output.segmented_audio_file.tolist()
     logger.info("Total number of segments: {}".format(output.shape[0]))
 
@@ -508,6 +559,9 @@ if __name__ == "__main__":
         keep_symbols=args.keep_symbols,
         keep_numerals=args.keep_numerals,
         verbose=args.verbose,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        cache_size=args.cache_size,
     )
 
     output.loc[:, "standardized_transcripts"] = standardized_transcripts
@@ -1,10 +1,21 @@
 import logging 
+import mmap
 import os
+import re
+import wave
+from collections import Counter, OrderedDict
+from functools import partial
+from struct import error as struct_error
+from multiprocessing import Pool
 from pydub import AudioSegment  # to segment the audio
 from subprocess import call  # for opening audios in VSCode
 
+from ..parsers.wav_utils import read_wav_header
+
 logger = logging.getLogger(__name__)
 
+multiple_spaces_pattern = re.compile(" +")
+
 def export_audio_segments(df, filename, audio_path_total): 
     """
     Given the path to downloaded data and a dataframe with the audio file names and start and end times,
@@ -38,11 +49,246 @@ def export_audio_segments(df, filename, audio_path_total):
         intaudio = intaudio.set_frame_rate(16000)
         intaudio.export(filename, format="wav", bitrate="16k")
 
+def group_segments_by_source(df, path_to_data):
+    """
+    Groups the rows of a segment table by the full audio file they are cut from, so that every
+    source recording only has to be decoded once.
+
+    Parameters
+    ----------
+    df: pandas Dataframe
+        Dataframe inherited from the consolidated_utterance class. Among its columns, we need to have
+        audio_file, start_time, end_time and segmented_audio_file (path to the sentence-segmented file).
+    path_to_data: str
+        Path to the main directory where the data is stored.
+
+    Returns
+    -------
+    sources: list of tuples
+        List of (audio_path_total, segments) sorted by audio_path_total, where segments is a list of
+        (start, end, filename) tuples with start and end in milliseconds, in the order of df.
+    """
+    segments_by_source = {}
+    for audio_file, start_time, end_time, filename in zip(
+        df.audio_file, df.start_time, df.end_time, df.segmented_audio_file
+    ):
+        audio_path_total = os.path.join(path_to_data, audio_file)
+        segments_by_source.setdefault(audio_path_total, []).append(
+            (round(start_time * 1000), round(end_time * 1000), filename)
+        )
+    return sorted(segments_by_source.items())
+
+def export_source_segments(audio_path_total, segments):
+    """
+    Creates all the sentence-segmented audio files cut from one full audio file, decoding the
+    full audio file once. Segments whose file already exists are skipped, and if all of them
+    exist the full audio file is not decoded at all. If the full audio file is already a 16kHz
+    16bit PCM wav file, the segments are copied byte by byte from the memory-mapped file
+    (see export_pcm_segments) and nothing is decoded or resampled.
+
+    Parameters
+    ----------
+    audio_path_total: str
+        Path to the full audio file.
+    segments: list of tuples
+        List of (start, end, filename) tuples, with start and end in milliseconds.
+
+    Returns
+    -------
+    n_exported: int
+        Number of segment files written.
+    """
+    pending = [(start, end, filename) for (start, end, filename) in segments if not os.path.isfile(filename)]
+    if not pending:
+        return 0
+    try:
+        header = read_wav_header(audio_path_total)
+    except (ValueError, OSError, struct_error):
+        header = None
+    if header is not None and header.is_pcm(sample_rate=16000, bits_per_sample=16):
+        return export_pcm_segments(audio_path_total, header, pending)
+    audioseg = AudioSegment.from_file(audio_path_total)
+    for start, end, filename in pending:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        intaudio = audioseg[start:end]
+        intaudio = intaudio.set_frame_rate(16000)
+        intaudio.export(filename, format="wav", bitrate="16k")
+    return len(pending)
+
+def export_pcm_segments(audio_path_total, header, segments):
+    """
+    Fast path of export_source_segments for full audio files that are already PCM wav files in
+    the target format. The file is memory-mapped and each segment is written by copying the byte range
+    of its frames, without decoding or resampling. Positions are converted from milliseconds to frames
+    and clipped to the length of the file in the same way as pydub does, so the segment files are
+    identical to the ones written through pydub.
+
+    Parameters
+    ----------
+    audio_path_total: str
+        Path to the full audio file.
+    header: wav_header
+        Header of the full audio file, as given by read_wav_header.
+    segments: list of tuples
+        List of (start, end, filename) tuples, with start and end in milliseconds.
+
+    Returns
+    -------
+    n_exported: int
+        Number of segment files written.
+    """
+    frame_width = header.frame_width
+    frames_per_ms = header.sample_rate / 1000.0
+    length_ms = round(1000 * (header.n_frames / header.sample_rate))
+    with open(audio_path_total, "rb") as audio_file, mmap.mmap(
+        audio_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as audio_map:
+        for start, end, filename in segments:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            start_frame = int(min(start, length_ms) * frames_per_ms)
+            end_frame = int(min(end, length_ms) * frames_per_ms)
+            frames = audio_map[
+                header.data_offset + start_frame * frame_width : header.data_offset
+                + max(start_frame, min(end_frame, header.n_frames)) * frame_width
+            ]
+            # rounding the length to milliseconds can ask for a few frames more than the file has,
+            # pydub pads those with silence
+            missing_frames = end_frame - start_frame - len(frames) // frame_width
+            if missing_frames > 0 and frames:
+                frames += bytes(frame_width * missing_frames)
+            with wave.open(filename, "wb") as segment:
+                segment.setnchannels(header.channels)
+                segment.setsampwidth(header.bits_per_sample // 8)
+                segment.setframerate(header.sample_rate)
+                segment.setnframes(len(frames) // frame_width)
+                segment.writeframesraw(frames)
+    return len(segments)
+
+def export_audio_segments_grouped(df, path_to_data):
+    """
+    Grouped version of export_audio_segments: instead of decoding the full audio file once per
+    segment, the segment table is grouped by source audio_file and each recording is decoded
+    once to write all of its slices. The segment files are identical to the ones written by
+    export_audio_segments.
+
+    Parameters
+    ----------
+    df: pandas Dataframe
+        Dataframe inherited from the consolidated_utterance class. Among its columns, we need to have
+        audio_file, start_time, end_time and segmented_audio_file (path to the sentence-segmented file).
+    path_to_data: str
+        Path to the main directory where the data is stored.
+
+    Returns
+    -------
+    n_exported: int
+        Number of segment files written.
+    """
+    n_exported = 0
+    for audio_path_total, segments in group_segments_by_source(df, path_to_data):
+        n_exported += export_source_segments(audio_path_total, segments)
+    return n_exported
+
+def _export_source_segments_job(job):
+    return export_source_segments(*job)
+
+def export_audio_segments_parallel(
+    df, path_to_data, workers=None, maxtasksperchild=10, log_every=100
+):
+    """
+    Parallel version of export_audio_segments_grouped. The segment table is sharded by source
+    audio_file and the recordings are distributed over a pool of worker processes. Each worker
+    holds at most one decoded recording at a time and is replaced after maxtasksperchild
+    recordings, which keeps the memory per worker bounded. Every segment file is written by the
+    same code as in the serial export, so the output is identical regardless of the number of workers.
+
+    Parameters
+    ----------
+    df: pandas Dataframe
+        Dataframe inherited from the consolidated_utterance class. Among its columns, we need to have
+        audio_file, start_time, end_time and segmented_audio_file (path to the sentence-segmented file).
+    path_to_data: str
+        Path to the main directory where the data is stored.
+    workers: int
+        Number of worker processes (default is None, i.e. os.cpu_count()). With workers=1 the
+        export runs serially in the current process.
+    maxtasksperchild: int
+        Number of recordings a worker processes before it is replaced by a fresh process.
+    log_every: int
+        Log the progress every log_every recordings.
+
+    Returns
+    -------
+    n_exported: int
+        Number of segment files written.
+    """
+    sources = group_segments_by_source(df, path_to_data)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(sources)))
+    logger.info(
+        "Exporting segments from {} recordings with {} worker(s)".format(len(sources), workers)
+    )
+    if workers == 1:
+        return _log_export_progress(map(_export_source_segments_job, sources), len(sources), log_every)
+    with Pool(processes=workers, maxtasksperchild=maxtasksperchild) as pool:
+        return _log_export_progress(
+            pool.imap_unordered(_export_source_segments_job, sources), len(sources), log_every
+        )
+
+def _log_export_progress(results, n_sources, log_every):
+    n_exported = 0
+    for n_done, n_written in enumerate(results, start=1):
+        n_exported += n_written
+        if n_done % log_every == 0 or n_done == n_sources:
+            logger.info(
+                "Processed {}/{} recordings, {} segments written".format(
+                    n_done, n_sources, n_exported
+                )
+            )
+    return n_exported
+
+class out_of_alphabet_result(tuple):
+    """
+    The 4-tuple (del_letters, del_words, del_sentences, index_sentence) returned by out_of_alphabet,
+    with the counts and the inverted index gathered in the same pass as attributes:
+
+    letter_counts: collections.Counter
+        Number of occurrences of each character outside the alphabet
+    word_counts: collections.Counter
+        Number of occurrences of each word containing characters outside the alphabet
+    letter_index: dict
+        Character outside the alphabet -> sorted list of the indices of the sentences containing it,
+        in the order of first appearance of the characters (the order of del_letters)
+    """
+
+    def __new__(
+        cls,
+        del_letters,
+        del_words,
+        del_sentences,
+        index_sentence,
+        letter_counts,
+        word_counts,
+        letter_index,
+    ):
+        result = super().__new__(cls, (del_letters, del_words, del_sentences, index_sentence))
+        result.letter_counts = letter_counts
+        result.word_counts = word_counts
+        result.letter_index = letter_index
+        return result
+
+    def __getnewargs__(self):
+        return tuple(self) + (self.letter_counts, self.word_counts, self.letter_index)
+
+
 def out_of_alphabet(transcription_list, alphabet):
     """
     Given a list of transcriptions (strings) and an alphabet (list of strings)
     identifies characters, words, sentences, and sentence indices that contain 
     characters outside the given alphabet.
+    The transcriptions are scanned once, checking the characters against a set, so
+    the cost is linear in the total number of characters.
     
     Parameters
     ----------
@@ -54,7 +300,8 @@ def out_of_alphabet(transcription_list, alphabet):
         
     Returns
     -------
-    Tuple with four lists of equal length:
+    out_of_alphabet_result, a tuple with four lists (letter_counts, word_counts and
+    letter_index are also available as attributes, see out_of_alphabet_result):
 
     del_letters: list of strings
         List of characters outside the given alphabet
@@ -68,25 +315,56 @@ def out_of_alphabet(transcription_list, alphabet):
         List of integers indicating the index positions from transcription_list that
         contain one or more characters outside the given alphabet
     """
-    del_letters = []
-    del_words = []
+    alphabet = frozenset(alphabet)
+    # Counters keep the order of first appearance, which is the order of del_letters and del_words
+    letter_counts = Counter()
+    word_counts = Counter()
+    letter_index = {}
     index_sentence = []
     del_sentences = []
-    
+
     for (i,x) in enumerate(transcription_list):
-        for y in x.lower().split(): # this makes that only transcriptions in lower case work
-            chars = list(y)
-            for letter in chars:
-                if letter not in alphabet:
-                    if letter not in del_letters:
-                        del_letters.append(letter)
-                    if y not in del_words:
-                        del_words.append(y)
-                    if i not in index_sentence:
-                        index_sentence.append(i)
-                        del_sentences.append(x)
-    
-    return del_letters, del_words, del_sentences, index_sentence
+        sentence = x.lower() # this makes that only transcriptions in lower case work
+        # whitespace separates the words and is never checked against the alphabet
+        if all(letter in alphabet or letter.isspace() for letter in set(sentence)):
+            continue
+        # a dict rather than a set, so that letter_index also has the order of first appearance
+        sentence_letters = {}
+        for y in sentence.split():
+            letters = [letter for letter in y if letter not in alphabet]
+            if letters:
+                letter_counts.update(letters)
+                word_counts[y] += 1
+                sentence_letters.update(dict.fromkeys(letters))
+        for letter in sentence_letters:
+            letter_index.setdefault(letter, []).append(i)
+        index_sentence.append(i)
+        del_sentences.append(x)
+
+    return out_of_alphabet_result(
+        list(letter_counts),
+        list(word_counts),
+        del_sentences,
+        index_sentence,
+        letter_counts,
+        word_counts,
+        letter_index,
+    )
+
+def iter_batches(iterable, batch_size):
+    """
+    Splits an iterable, e.g. the utterances yielded by one of the parsers.iter_* generators,
+    into lists of at most batch_size items, so that they can be standardized and saved
+    without holding the whole corpus in memory.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 def play_audios(
     standardized_transcripts, out_of_alphabet_info, audio_list
@@ -113,8 +391,9 @@ def play_audios(
     # Sentence replacement given an input after playing audio file (requires personalizing to the structure of the data)
     # Commented code below is work in progress for creating a dictionary of substitutions "on the fly"
     # sentence_Dict = {}
+    index_sentence = set(out_of_alphabet_info[3])
     for (i, s) in enumerate(standardized_transcripts):
-        if i in out_of_alphabet_info[3]:
+        if i in index_sentence:
             logger.info("Audio: {}".format(audio_list[i]))
             logger.info("Transcript: {}".format(standardized_transcripts[i]))
             call(["code", audio_list[i]])
@@ -232,10 +511,81 @@ def replace_symbols(sentence, wordDic_sym):
         Sentence where the expressions with tokens in wordDic_sym (keys) have been substituted
         by the values.
     """
+    if isinstance(wordDic_sym, compiled_substitutions):
+        return wordDic_sym(sentence)
     for ini, out in wordDic_sym.items():
         sentence = sentence.replace(ini, out)
     return sentence 
 
+def _overlaps(left, right):
+    """True if a proper suffix of left is a proper prefix of right"""
+    return any(left[-k:] == right[:k] for k in range(1, min(len(left), len(right))))
+
+def _rules_interact(earlier, later):
+    """
+    True if applying the rule earlier and then the rule later with str.replace can give a different
+    result than replacing both in one left-to-right scan where earlier has priority, i.e. if earlier
+    is a substring of later, if later can start inside an earlier match, or if later can match text
+    produced (or joined, for deletions) by the replacement of earlier.
+    """
+    (ini_earlier, out_earlier), (ini_later, _) = earlier, later
+    # str.replace with an empty pattern inserts between every character, keep those on their own
+    if not ini_later or ini_earlier in ini_later or _overlaps(ini_later, ini_earlier):
+        return True
+    if not out_earlier:
+        return len(ini_later) > 1
+    return (
+        out_earlier in ini_later
+        or ini_later in out_earlier
+        or _overlaps(out_earlier, ini_later)
+        or _overlaps(ini_later, out_earlier)
+    )
+
+class compiled_substitutions:
+    """
+    Compiled version of a substitution dictionary as used by replace_symbols. The rules are split
+    into the fewest consecutive stages in which no rule interacts with an earlier rule of the same stage
+    (see _rules_interact), and each stage is applied in a single scan with an alternation regex that gives
+    priority to the earlier rules. The result is the same as applying str.replace for each rule in order,
+    including the rule order effects (e.g. "co2-" before "co2"), but typically with a handful of scans
+    per sentence instead of one per rule. Build it once per dictionary and call it on each sentence:
+
+        numerals = compiled_substitutions(wordDic_num)
+        sentence = numerals(sentence)
+
+    Instances can also be given to replace_symbols in place of the dictionary.
+    """
+
+    def __init__(self, wordDic):
+        self.wordDic = dict(wordDic)
+        groups = []
+        for rule in self.wordDic.items():
+            if groups and all(not _rules_interact(earlier, rule) for earlier in groups[-1]):
+                groups[-1].append(rule)
+            else:
+                groups.append([rule])
+        self.stages = [self._compile_stage(group) for group in groups]
+
+    @staticmethod
+    def _compile_stage(group):
+        if len(group) == 1:
+            return group[0]
+        replacements = dict(group)
+        pattern = re.compile("|".join(re.escape(ini) for ini, _ in group))
+        return pattern, replacements
+
+    def __call__(self, sentence):
+        for stage in self.stages:
+            if isinstance(stage[0], str):
+                sentence = sentence.replace(*stage)
+            else:
+                pattern, replacements = stage
+                sentence = pattern.sub(lambda match: replacements[match.group()], sentence)
+        return sentence
+
+    def __len__(self):
+        return len(self.wordDic)
+
 def substitute_hesitations(
     sentence, keep_annotations, annotation_token, substitution_token, wordDic_hes={}
 ):
@@ -281,4 +631,195 @@ def substitute_underscores(sentence):
     It is important to apply this function before any other tokens
     (such as non-verbal annotations) are substituted by an underscore.
     """
-    return sentence.replace('_', ' ')
\ No newline at end of file
+    return sentence.replace('_', ' ')
+
+def remove_extra_spaces(sentence):
+    """
+    For a sentence, collapses repeated spaces into one and strips whitespace at both ends.
+    """
+    return multiple_spaces_pattern.sub(" ", sentence).strip()
+
+class sentence_pipeline:
+    """
+    Sequence of standardization stages fused into one function of a sentence, so that a list of
+    transcriptions is standardized in a single pass instead of building a new list per stage.
+    Stages are added in order with add() and are only picklable functions, functools.partial objects
+    or compiled_substitutions, so that the pipeline can be sent to other processes:
+
+        pipeline = sentence_pipeline()
+        pipeline.add(str.lower)
+        pipeline.add(substitute_underscores, when="_")
+        pipeline.add(compiled_substitutions(wordDic_sym))
+        pipeline.add(remove_extra_spaces)
+        standardized_sentences = pipeline.map(transcription_list)
+    """
+
+    def __init__(self, stages=()):
+        # list of (stage, when) tuples
+        self.stages = list(stages)
+
+    def add(self, stage, when=None, **kwargs):
+        """
+        Adds stage(sentence, **kwargs) at the end of the pipeline. If when is given, the stage is only
+        applied to sentences that contain the string when.
+        """
+        self.stages.append((partial(stage, **kwargs) if kwargs else stage, when))
+        return self
+
+    def copy(self):
+        return sentence_pipeline(self.stages)
+
+    def __call__(self, sentence):
+        for stage, when in self.stages:
+            if when is None or when in sentence:
+                sentence = stage(sentence)
+        return sentence
+
+    def map(self, sentences, workers=1, chunksize=None, cache_size=None):
+        """
+        Standardizes a list of sentences, returns a list of the same length and in the same order.
+        With workers > 1 the list is split into chunks of chunksize sentences (default is an even split
+        in 4 chunks per worker) that are standardized in a pool of worker processes.
+        With cache_size != 0 each distinct sentence is standardized once and its result is reused for
+        every repetition, keeping at most cache_size results (None for no limit) in a
+        sentence_cache, one per worker process. The hit ratio of the cache is logged.
+        """
+        with pipeline_mapper(
+            self, workers=workers, chunksize=chunksize, cache_size=cache_size
+        ) as mapper:
+            return mapper.map(sentences)
+
+
+class pipeline_mapper:
+    """
+    Standardizes successive lists of sentences with the same sentence_pipeline, as sentence_pipeline.map
+    does for one list, but keeping the sentence_cache and the pool of worker processes (started with the
+    first list that needs it) from one list to the next, so that transcriptions repeated across batches
+    are standardized only once per process. The hit ratio of the cache is logged on close:
+
+        with pipeline_mapper(pipeline, workers=4) as mapper:
+            for batch in batches:
+                standardized_sentences = mapper.map(batch)
+    """
+
+    def __init__(self, pipeline, workers=1, chunksize=None, cache_size=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.pipeline = pipeline
+        self.workers = workers
+        self.chunksize = chunksize
+        self.cache_size = cache_size
+        # used when the sentences are standardized in this process
+        self.cache = None if cache_size == 0 else sentence_cache(pipeline, cache_size)
+        # calls answered by the caches of the worker processes
+        self.hits = 0
+        self.misses = 0
+        self._pool = None
+
+    def map(self, sentences):
+        """Standardizes a list of sentences, returns a list of the same length and in the same order"""
+        if self.workers <= 1 or len(sentences) < 2:
+            func = self.pipeline if self.cache is None else self.cache
+            return [func(sentence) for sentence in sentences]
+        sentences = list(sentences)
+        chunksize = self.chunksize
+        if chunksize is None:
+            chunksize = -(-len(sentences) // (self.workers * 4))
+        chunks = [sentences[i : i + chunksize] for i in range(0, len(sentences), chunksize)]
+        if self._pool is None:
+            self._pool = Pool(
+                processes=min(self.workers, len(chunks)),
+                initializer=_init_pipeline_worker,
+                initargs=(self.pipeline, self.cache_size),
+            )
+        standardized_sentences = []
+        for chunk, chunk_hits, chunk_misses in self._pool.imap(_map_pipeline_chunk, chunks):
+            standardized_sentences.extend(chunk)
+            self.hits += chunk_hits
+            self.misses += chunk_misses
+        return standardized_sentences
+
+    def close(self):
+        """Stops the worker processes and logs the hit ratio of the cache"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self.cache is not None:
+            _log_hit_ratio(self.hits + self.cache.hits, self.misses + self.cache.misses)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self.close()
+
+
+class sentence_cache:
+    """
+    LRU memo of a function of a sentence, typically a sentence_pipeline. Repeated transcriptions (e.g.
+    the read prompts of NST) are standardized only once. At most max_size results are kept, None
+    for no limit. hits and misses count the calls answered from the cache and the calls to func.
+    """
+
+    def __init__(self, func, max_size=None):
+        self.func = func
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # sentence -> standardized sentence, least recently used first
+        self._results = OrderedDict()
+
+    def __call__(self, sentence):
+        try:
+            result = self._results[sentence]
+        except KeyError:
+            self.misses += 1
+            result = self._results[sentence] = self.func(sentence)
+            if self.max_size is not None and len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+            return result
+        self.hits += 1
+        self._results.move_to_end(sentence)
+        return result
+
+    def __len__(self):
+        return len(self._results)
+
+    @property
+    def hit_ratio(self):
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    def log_hit_ratio(self):
+        _log_hit_ratio(self.hits, self.misses)
+
+
+def _log_hit_ratio(hits, misses):
+    calls = hits + misses
+    logger.info(
+        "Standardization cache: {} of {} transcriptions reused from the cache (hit ratio {:.1%})".format(
+            hits, calls, hits / calls if calls else 0.0
+        )
+    )
+
+# pipeline of the current worker process, set once per process by the pool initializer
+_worker_pipeline = None
+
+def _init_pipeline_worker(pipeline, cache_size=0):
+    global _worker_pipeline
+    _worker_pipeline = pipeline if cache_size == 0 else sentence_cache(pipeline, cache_size)
+
+def _map_pipeline_chunk(chunk):
+    if not isinstance(_worker_pipeline, sentence_cache):
+        return [_worker_pipeline(sentence) for sentence in chunk], 0, 0
+    hits, misses = _worker_pipeline.hits, _worker_pipeline.misses
+    standardized_chunk = [_worker_pipeline(sentence) for sentence in chunk]
+    return (
+        standardized_chunk,
+        _worker_pipeline.hits - hits,
+        _worker_pipeline.misses - misses,
+    )